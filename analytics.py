@@ -0,0 +1,304 @@
+import asyncio
+import base64
+import logging
+import time
+from collections import Counter, deque
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from sketches import HyperLogLog
+
+logger = logging.getLogger('Analytics')
+
+
+class ClickCounter:
+    """
+    In-memory per-link click counters with write-behind flushing.
+
+    ``hit()`` is called on the link resolution path, so it only touches a
+    dict; clicks are grouped into time buckets (hourly by default) and
+    handed to the link store in one batch by ``flush()``.
+    """
+
+    def __init__(self, bucket_seconds: int = 3600):
+        self.bucket_seconds = bucket_seconds
+        self._bucket = int(time.time()) // bucket_seconds
+        self._counts: Dict[str, int] = {}
+        # Buckets that rolled over since the last flush
+        self._closed: Dict[int, Dict[str, int]] = {}
+        self.total_clicks = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+    def hit(self, token: str):
+        """Count one click on a link"""
+        bucket = int(time.time()) // self.bucket_seconds
+        if bucket != self._bucket:
+            self._closed[self._bucket] = self._counts
+            self._bucket = bucket
+            self._counts = {}
+        counts = self._counts
+        counts[token] = counts.get(token, 0) + 1
+        self.total_clicks += 1
+
+    def _take(self) -> Dict[int, Dict[str, int]]:
+        """Swap out everything buffered so far"""
+        pending = self._closed
+        if self._counts:
+            pending[self._bucket] = self._counts
+        self._closed = {}
+        self._counts = {}
+        return pending
+
+    def _restore(self, pending: Dict[int, Dict[str, int]]):
+        """Merge an unflushed batch back into the buffers"""
+        for bucket, counts in pending.items():
+            target = self._counts if bucket == self._bucket else self._closed.setdefault(bucket, {})
+            for token, clicks in counts.items():
+                target[token] = target.get(token, 0) + clicks
+
+    async def flush(self, store):
+        """Write buffered clicks to the store in one batch"""
+        pending = self._take()
+        if not pending:
+            return
+        started = time.perf_counter()
+        try:
+            await store.add_clicks(pending)
+        except Exception:
+            self._restore(pending)
+            raise
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def run_flusher(self, store, interval: int = 60):
+        """Periodically flush buffered clicks"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush(store)
+            except Exception as e:
+                logger.error(f"Error flushing click counters: {e}")
+
+    def get_stats(self) -> Dict:
+        """Get click counter statistics"""
+        return {
+            'total_clicks': self.total_clicks,
+            'buffered_links': len(self._counts) + sum(len(c) for c in self._closed.values()),
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
+
+
+class VisitorCounter:
+    """
+    Approximate unique visitors per link.
+
+    Each link gets one HyperLogLog sketch per time bucket (daily by
+    default), so memory per link is fixed no matter how many users open it.
+    Only sketches touched since the last flush are held in memory; the
+    link store merges them into the persisted ones.
+    """
+
+    def __init__(self, bucket_seconds: int = 86400, precision: int = 11):
+        self.bucket_seconds = bucket_seconds
+        self.precision = precision
+        self._bucket = int(time.time()) // bucket_seconds
+        self._sketches: Dict[str, HyperLogLog] = {}
+        self._closed: Dict[int, Dict[str, HyperLogLog]] = {}
+        self.flushes = 0
+
+    def add(self, token: str, user_id: int):
+        """Record that a user opened a link"""
+        bucket = int(time.time()) // self.bucket_seconds
+        if bucket != self._bucket:
+            self._closed[self._bucket] = self._sketches
+            self._bucket = bucket
+            self._sketches = {}
+        sketch = self._sketches.get(token)
+        if sketch is None:
+            sketch = self._sketches[token] = HyperLogLog(self.precision)
+        sketch.add(user_id)
+
+    def _take(self) -> Dict[int, Dict[str, HyperLogLog]]:
+        pending = self._closed
+        if self._sketches:
+            pending[self._bucket] = self._sketches
+        self._closed = {}
+        self._sketches = {}
+        return pending
+
+    def _restore(self, pending: Dict[int, Dict[str, HyperLogLog]]):
+        for bucket, sketches in pending.items():
+            target = self._sketches if bucket == self._bucket else self._closed.setdefault(bucket, {})
+            for token, sketch in sketches.items():
+                if token in target:
+                    target[token].merge(sketch)
+                else:
+                    target[token] = sketch
+
+    async def flush(self, store):
+        """Merge buffered sketches into the store in one batch"""
+        pending = self._take()
+        if not pending:
+            return
+        try:
+            await store.merge_sketches(pending)
+        except Exception:
+            self._restore(pending)
+            raise
+        self.flushes += 1
+
+    async def run_flusher(self, store, interval: int = 300):
+        """Periodically flush buffered sketches"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush(store)
+            except Exception as e:
+                logger.error(f"Error flushing visitor sketches: {e}")
+
+    async def estimate(self, store, token: str, since_bucket: Optional[int] = None) -> int:
+        """
+        Estimated unique visitors of a link since a bucket, or over its whole
+        lifetime when ``since_bucket`` is None
+        """
+        stored = await store.get_sketches(token)
+        if since_bucket is None:
+            sketches = [stored['all']] if 'all' in stored else []
+        else:
+            sketches = [s for b, s in stored.items() if b != 'all' and int(b) >= since_bucket]
+        # Include what has not been flushed yet
+        for bucket, buffered in list(self._closed.items()) + [(self._bucket, self._sketches)]:
+            if token in buffered and (since_bucket is None or bucket >= since_bucket):
+                sketches.append(buffered[token])
+        return HyperLogLog.merged(sketches, self.precision).count()
+
+    def get_stats(self) -> Dict:
+        """Get visitor counter statistics"""
+        return {
+            'buffered_sketches': len(self._sketches) + sum(len(s) for s in self._closed.values()),
+            'flushes': self.flushes
+        }
+
+
+class WindowedCounter:
+    """
+    Rolling per-key counters at several time resolutions.
+
+    Each resolution keeps a fixed number of buckets (by default 60 minutes,
+    24 hours and 30 days); old buckets fall off as new ones open, so memory
+    and query cost depend on the number of buckets, not on traffic.
+    """
+
+    def __init__(self, resolutions: Optional[Dict[str, Tuple[int, int]]] = None):
+        # name -> (bucket_seconds, buckets kept)
+        self.resolutions = resolutions or {'minute': (60, 60), 'hour': (3600, 24), 'day': (86400, 30)}
+        self._buckets: Dict[str, deque] = {
+            name: deque(maxlen=kept) for name, (_, kept) in self.resolutions.items()
+        }
+
+    def add(self, key: Hashable, n: int = 1, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        for name, (seconds, _) in self.resolutions.items():
+            bucket = int(now) // seconds
+            buckets = self._buckets[name]
+            if not buckets or buckets[-1][0] != bucket:
+                buckets.append((bucket, Counter()))
+            buckets[-1][1][key] += n
+
+    def totals(self, resolution: str, last: int = 1, now: Optional[float] = None) -> Counter:
+        """Per-key totals over the last ``last`` buckets (including the current one)"""
+        now = time.time() if now is None else now
+        current = int(now) // self.resolutions[resolution][0]
+        total = Counter()
+        for bucket, counts in self._buckets[resolution]:
+            if bucket > current - last:
+                total.update(counts)
+        return total
+
+    def series(self, resolution: str, key: Optional[Hashable] = None,
+               now: Optional[float] = None) -> List[Tuple[int, int]]:
+        """
+        (bucket start timestamp, count) for every kept bucket, oldest first,
+        gaps as zero. Counts are for ``key``, or all keys together when None.
+        """
+        now = time.time() if now is None else now
+        seconds, kept = self.resolutions[resolution]
+        current = int(now) // seconds
+        counts = {bucket: (sum(c.values()) if key is None else c.get(key, 0))
+                  for bucket, c in self._buckets[resolution]}
+        return [(b * seconds, counts.get(b, 0)) for b in range(current - kept + 1, current + 1)]
+
+    def state(self) -> Dict[str, list]:
+        """JSON-serializable buckets, for snapshots"""
+        return {name: [[bucket, dict(counts)] for bucket, counts in buckets]
+                for name, buckets in self._buckets.items()}
+
+    def restore(self, state: Dict[str, list]):
+        for name, buckets in state.items():
+            if name in self._buckets:
+                self._buckets[name].extend((bucket, Counter(counts)) for bucket, counts in buckets)
+
+
+class WindowedDistinct:
+    """
+    Approximate distinct items (e.g. users) per time window.
+
+    Keeps one HyperLogLog per bucket at each resolution of a
+    WindowedCounter; a window's count is the union of its buckets'
+    sketches, so it costs O(buckets) whatever the traffic.
+    """
+
+    def __init__(self, resolutions: Optional[Dict[str, Tuple[int, int]]] = None, precision: int = 11):
+        self.resolutions = resolutions or {'minute': (60, 60), 'hour': (3600, 24), 'day': (86400, 30)}
+        self.precision = precision
+        self._buckets: Dict[str, deque] = {
+            name: deque(maxlen=kept) for name, (_, kept) in self.resolutions.items()
+        }
+
+    def add(self, item: Hashable, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        for name, (seconds, _) in self.resolutions.items():
+            bucket = int(now) // seconds
+            buckets = self._buckets[name]
+            if not buckets or buckets[-1][0] != bucket:
+                buckets.append((bucket, HyperLogLog(self.precision)))
+            buckets[-1][1].add(item)
+
+    def count(self, resolution: str, last: int = 1, now: Optional[float] = None) -> int:
+        """Estimated distinct items over the last ``last`` buckets (including the current one)"""
+        now = time.time() if now is None else now
+        current = int(now) // self.resolutions[resolution][0]
+        sketches = [sketch for bucket, sketch in self._buckets[resolution] if bucket > current - last]
+        return HyperLogLog.merged(sketches, self.precision).count()
+
+    def state(self) -> Dict[str, list]:
+        """JSON-serializable buckets (base64 sketches), for snapshots"""
+        return {name: [[bucket, base64.b64encode(sketch.to_bytes()).decode()] for bucket, sketch in buckets]
+                for name, buckets in self._buckets.items()}
+
+    def restore(self, state: Dict[str, list]):
+        for name, buckets in state.items():
+            if name in self._buckets:
+                self._buckets[name].extend(
+                    (bucket, HyperLogLog.from_bytes(base64.b64decode(data))) for bucket, data in buckets
+                )
+
+
+class LatencyWindow:
+    """Keeps the most recent samples of an operation's latency for percentiles"""
+
+    def __init__(self, size: int = 1000):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, ms: float):
+        self._samples.append(ms)
+        self.count += 1
+
+    def percentiles(self, points=(50, 90, 99)) -> Dict[str, float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {f'p{p}': 0.0 for p in points}
+        last = len(samples) - 1
+        return {f'p{p}': round(samples[min(last, int(round(p / 100 * last)))], 3) for p in points}
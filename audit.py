@@ -0,0 +1,208 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional: diffs fall back to a plain loop
+    np = None
+
+logger = logging.getLogger('Audit')
+
+# Whether batch lookups and diffs run vectorized
+VECTORIZED = np is not None
+
+_MAGIC = b'SEEN1\0' + (b'LE' if sys.byteorder == 'little' else b'BE')
+_HEADER = struct.Struct('<8sQI')  # magic, users, country names blob size
+_LOW64 = (1 << 64) - 1
+
+
+class LastSeenIPs:
+    """
+    Last IP seen per verified user, plus the country it resolved to when
+    last checked or audited (the baseline the next audit diffs against).
+
+    The table is five parallel arrays sorted by user id (27 bytes per user),
+    searched with bisect. Addresses are split into high and low 64 bits;
+    countries are small ids into ``country_names``. The table is
+    snapshotted to a binary file by ``snapshot`` when it changed.
+    """
+
+    def __init__(self, path: Optional[str] = 'last_seen.bin'):
+        self.path = path
+        self.user_ids = array('q')
+        self.addr_hi = array('Q')
+        self.addr_lo = array('Q')
+        self.is_v6 = array('b')
+        self.countries = array('h')
+        self.country_names: List[str] = []
+        self._country_ids: Dict[str, int] = {}
+        self._dirty = False
+
+    def _arrays(self) -> Tuple[array, array, array, array, array]:
+        return self.user_ids, self.addr_hi, self.addr_lo, self.is_v6, self.countries
+
+    def _find(self, user_id: int) -> Tuple[int, bool]:
+        """(position, found): where ``user_id`` is or would be inserted"""
+        i = bisect_left(self.user_ids, user_id)
+        return i, i < len(self.user_ids) and self.user_ids[i] == user_id
+
+    def _country_id(self, country: Optional[str]) -> int:
+        if country is None:
+            return -1
+        cid = self._country_ids.get(country)
+        if cid is None:
+            cid = self._country_ids[country] = len(self.country_names)
+            self.country_names.append(country)
+        return cid
+
+    def record(self, user_id: int, ip: str, country: Optional[str] = None):
+        """Remember a user's IP; keeps the previous country if none is given"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        value = int(address)
+        row = (user_id, value >> 64, value & _LOW64, address.version == 6)
+        i, found = self._find(user_id)
+        if found:
+            cid = self._country_id(country) if country is not None else self.countries[i]
+            if (self.addr_hi[i], self.addr_lo[i], bool(self.is_v6[i]), self.countries[i]) == (*row[1:], cid):
+                return
+            for column, value in zip(self._arrays(), (*row, cid)):
+                column[i] = value
+        else:
+            for column, value in zip(self._arrays(), (*row, self._country_id(country))):
+                column.insert(i, value)
+        self._dirty = True
+
+    def set_country(self, user_id: int, country: str):
+        i, found = self._find(user_id)
+        if found:
+            self.countries[i] = self._country_id(country)
+            self._dirty = True
+
+    def forget(self, user_id: int):
+        """Drop a user's entry (e.g. when they lose verified status)"""
+        i, found = self._find(user_id)
+        if found:
+            for column in self._arrays():
+                del column[i]
+            self._dirty = True
+
+    def country_of(self, user_id: int) -> Optional[str]:
+        i, found = self._find(user_id)
+        return self.country_names[self.countries[i]] if found and self.countries[i] >= 0 else None
+
+    def ip_of(self, user_id: int) -> Optional[str]:
+        i, found = self._find(user_id)
+        if not found:
+            return None
+        if self.is_v6[i]:
+            return str(ipaddress.IPv6Address((self.addr_hi[i] << 64) | self.addr_lo[i]))
+        return str(ipaddress.IPv4Address(self.addr_lo[i]))
+
+    def copy(self) -> 'LastSeenIPs':
+        """Detached copy of the table (not persisted), for reading off the event loop"""
+        table = LastSeenIPs(None)
+        table.user_ids, table.addr_hi, table.addr_lo, table.is_v6, table.countries = \
+            (array(column.typecode, column) for column in self._arrays())
+        table.country_names = list(self.country_names)
+        table._country_ids = dict(self._country_ids)
+        return table
+
+    def columns(self, users) -> Tuple[array, array, array, array]:
+        """
+        Parallel arrays for the recorded users that are in ``users``:
+        (user ids, GeoIP search keys, IPv6 flags, baseline country ids)
+        """
+        user_ids, keys, is_v6, countries = array('q'), array('Q'), array('b'), array('h')
+        for user_id, hi, lo, v6, cid in zip(*self._arrays()):
+            if user_id not in users:
+                continue
+            user_ids.append(user_id)
+            keys.append(hi if v6 else lo)
+            is_v6.append(v6)
+            countries.append(cid)
+        return user_ids, keys, is_v6, countries
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if len(data) < _HEADER.size or data[:8] != _MAGIC:
+            logger.warning(f"Ignoring unreadable {self.path}")
+            return
+        _, count, blob_size = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        columns = []
+        for typecode in ('q', 'Q', 'Q', 'b', 'h'):
+            column = array(typecode)
+            size = column.itemsize * count
+            column.frombytes(data[offset:offset + size])
+            columns.append(column)
+            offset += size
+        self.country_names = json.loads(data[offset:offset + blob_size])
+        self._country_ids = {name: i for i, name in enumerate(self.country_names)}
+        user_ids = columns[0]
+        if any(user_ids[i] > user_ids[i + 1] for i in range(len(user_ids) - 1)):
+            # Files written before the table was kept sorted
+            order = sorted(range(len(user_ids)), key=user_ids.__getitem__)
+            columns = [array(column.typecode, (column[i] for i in order)) for column in columns]
+        self.user_ids, self.addr_hi, self.addr_lo, self.is_v6, self.countries = columns
+
+    def _encode(self) -> bytes:
+        names = json.dumps(self.country_names).encode()
+        return b''.join([_HEADER.pack(_MAGIC, len(self.user_ids), len(names)),
+                         *(column.tobytes() for column in self._arrays()), names])
+
+    def _write(self, data: bytes):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    async def snapshot(self):
+        """Persist the table if anything changed since the last snapshot"""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        await asyncio.to_thread(self._write, self._encode())
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+
+def diff_countries(geoip, keys: array, is_v6: array, baseline: array, translate: List[int]):
+    """
+    Resolve every address against the GeoIP table and compare with the
+    baseline. ``translate`` maps baseline country ids to GeoIP country ids.
+    Returns (current GeoIP country ids, positions whose country changed).
+    Addresses the table does not cover are never reported as changed.
+    """
+    if not len(keys):
+        return array('i'), []
+    current = geoip.lookup_many(keys, is_v6)
+    if np is not None:
+        # The extra -1 slot catches baseline entries without a country (id -1)
+        previous = np.asarray(translate + [-1], dtype=np.int32)[np.frombuffer(baseline, dtype=np.int16)]
+        current = np.asarray(current, dtype=np.int32)
+        changed = np.nonzero((current >= 0) & (current != previous))[0]
+        return current, changed.tolist()
+    translate = translate + [-1]
+    changed = [i for i, (now, before) in enumerate(zip(current, baseline))
+               if now >= 0 and now != translate[before]]
+    return current, changed
@@ -0,0 +1,77 @@
+"""
+Memory and lookup benchmark: Python set vs IdSet for user id membership.
+
+    python benchmarks/idset_bench.py [count]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from idset import IdSet  # noqa: E402
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size, elapsed
+
+
+def lookups_per_second(container, probes):
+    started = time.perf_counter()
+    hits = sum(1 for user_id in probes if user_id in container)
+    elapsed = time.perf_counter() - started
+    return len(probes) / elapsed, hits
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # Telegram user ids are positive and currently below ~8e9
+    ids = random.sample(range(1, 8_000_000_000), count)
+    probes = random.sample(ids, 50_000) + [random.randrange(1, 8_000_000_000) for _ in range(50_000)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'users.json')
+        ids_path = os.path.join(tmp, 'users.ids')
+        with open(json_path, 'w') as f:
+            json.dump({'userban': ids}, f)
+
+        def load_json():
+            with open(json_path) as f:
+                return set(json.load(f)['userban'])
+
+        as_set, set_bytes, set_load = measure(load_json)
+        as_idset, idset_bytes, idset_build = measure(lambda: IdSet.from_iterable(ids))
+        as_idset.save(ids_path)
+        mapped, mapped_bytes, mapped_load = measure(lambda: IdSet.load(ids_path))
+
+        print(f"{count:,} ids")
+        print(f"{'':22}{'memory':>12}{'load':>12}{'lookups/s':>14}")
+        for name, container, size, load in (
+            ('set (from JSON)', as_set, set_bytes, set_load),
+            ('IdSet (in memory)', as_idset, idset_bytes, idset_build),
+            ('IdSet (mmap)', mapped, mapped_bytes, mapped_load),
+        ):
+            rate, hits = lookups_per_second(container, probes)
+            print(f"{name:22}{size / 1e6:>10.1f}MB{load * 1000:>10.1f}ms{rate:>14,.0f}")
+
+        # Churn: adds/removes going through the delta sets and merges
+        started = time.perf_counter()
+        for user_id in random.sample(range(8_000_000_000, 9_000_000_000), 100_000):
+            as_idset.add(user_id)
+        print(f"100,000 adds: {(time.perf_counter() - started) * 1000:.0f}ms "
+              f"({as_idset.merges} merges)")
+        del mapped
+
+
+if __name__ == '__main__':
+    main()
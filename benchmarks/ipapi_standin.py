@@ -0,0 +1,140 @@
+"""
+Local stand-in for ip-api.com with the free tier's limits, and a driver
+that runs IPChecker's rate limiter against it.
+
+    python benchmarks/ipapi_standin.py serve [port]
+    python benchmarks/ipapi_standin.py drive [interactive] [background] [window]
+
+``serve`` answers ``/json/<ip>`` like ip-api.com: X-Rl / X-Ttl headers,
+429 past 45 requests per window and status 'fail' for addresses that are
+not public. Point the bot at it with IP_API_URL=http://127.0.0.1:8081/json/.
+
+``drive`` starts the stand-in in-process, queues background lookups, then
+fires interactive ones while they wait, and reports when each priority
+was served and whether the stand-in ever had to throttle. A shorter
+window (e.g. 6 seconds) scales the limits down for a quick run.
+"""
+import asyncio
+import ipaddress
+import os
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from concurrency import TokenBucket  # noqa: E402
+from ip import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, GeoLookupUnavailable, IPChecker  # noqa: E402
+
+
+class StandIn:
+    """Fixed-window limiter and fake answers in ip-api.com's format"""
+
+    def __init__(self, limit: int = 45, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.served = 0
+        self.throttled = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start = now
+            self.used = 0
+        ttl = str(max(1, int(self.window - (now - self.window_start))))
+        if self.used >= self.limit:
+            self.throttled += 1
+            return web.Response(status=429, headers={'X-Rl': '0', 'X-Ttl': ttl})
+        self.used += 1
+        self.served += 1
+        headers = {'X-Rl': str(self.limit - self.used), 'X-Ttl': ttl}
+
+        query = request.match_info['ip']
+        try:
+            address = ipaddress.ip_address(query)
+        except ValueError:
+            return web.json_response({'status': 'fail', 'message': 'invalid query', 'query': query}, headers=headers)
+        if not address.is_global:
+            return web.json_response({'status': 'fail', 'message': 'reserved range', 'query': query}, headers=headers)
+        return web.json_response({
+            'status': 'success',
+            'country': 'India' if int(address) % 2 == 0 else 'Germany',
+            'regionName': 'Stand-in',
+            'city': 'Stand-in',
+            'isp': 'Stand-in',
+            'timezone': 'UTC',
+            'query': query
+        }, headers=headers)
+
+
+async def start_standin(standin: StandIn, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/json/{ip}', standin.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def serve(port: int):
+    await start_standin(StandIn(), port)
+    print(f"ip-api.com stand-in on http://127.0.0.1:{port}/json/")
+    await asyncio.Event().wait()
+
+
+async def drive(interactive: int, background: int, window: float, port: int = 8081):
+    standin = StandIn(window=window)
+    runner = await start_standin(standin, port)
+    checker = IPChecker(api_url=f'http://127.0.0.1:{port}/json/', api_max_wait=2 * window)
+    checker.limiter = TokenBucket(limit=45, window=window, max_waiters=interactive + background)
+
+    started = time.monotonic()
+    served = {PRIORITY_INTERACTIVE: [], PRIORITY_BACKGROUND: []}
+    unavailable = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+
+    async def check(ip: str, priority: int):
+        try:
+            await checker.check_ip(ip, priority)
+            served[priority].append(time.monotonic() - started)
+        except GeoLookupUnavailable:
+            unavailable[priority] += 1
+
+    # Background work is queued first; interactive checks arrive while it waits
+    tasks = [asyncio.ensure_future(check(f"8.8.{i // 250}.{i % 250 + 1}", PRIORITY_BACKGROUND))
+             for i in range(background)]
+    await asyncio.sleep(0.1)
+    tasks += [asyncio.ensure_future(check(f"9.9.{i // 250}.{i % 250 + 1}", PRIORITY_INTERACTIVE))
+              for i in range(interactive)]
+    await asyncio.gather(*tasks)
+
+    for name, priority in (('interactive', PRIORITY_INTERACTIVE), ('background', PRIORITY_BACKGROUND)):
+        times = served[priority]
+        if times:
+            print(f"{name:12} served {len(times):4}  median {statistics.median(times):6.2f}s  "
+                  f"last {max(times):6.2f}s  unavailable {unavailable[priority]}")
+        else:
+            print(f"{name:12} served    0  unavailable {unavailable[priority]}")
+    print(f"stand-in: {standin.served} served, {standin.throttled} throttled (429)")
+    print(f"limiter: {checker.limiter.get_stats()}")
+
+    await checker.http.close()
+    await runner.cleanup()
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'drive'
+    if mode == 'serve':
+        asyncio.run(serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8081))
+        return
+    interactive = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    background = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    window = float(sys.argv[4]) if len(sys.argv) > 4 else 60
+    asyncio.run(drive(interactive, background, window))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,26 +9,36 @@ from pyrogram.types import (
 )
 from pyrogram.enums import ParseMode
 from pyrogram.handlers import MessageHandler
-from config import API_ID, API_HASH, BOT_TOKEN, MONGO_URL
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, MONGO_URL,
+    LINK_CACHE_SIZE, LINK_CACHE_TTL, LINK_TOKEN_SECRET, LINK_STORE,
+    VERIFY_TOKEN_MODE,
+    IP_GEO_CACHE_SIZE, IP_GEO_CACHE_TTL, IP_USER_CACHE_SIZE, IP_USER_CACHE_TTL,
+    GEOIP_CSV, IP_API_URL, IP_API_RATE_LIMIT, IP_API_QUEUE_SIZE, IP_API_MAX_WAIT,
+    REAUDIT_INTERVAL
+)
 import motor.motor_asyncio
-import aiohttp
 import json
 import re
 from urllib.parse import quote, quote_plus, urlparse
-import base64
 import time
 import random
-import string
 import asyncio
+import io
 from datetime import datetime, timedelta
 from flask import Flask
 import threading
 from waitress import serve
-from helper import log_command, log_callback, setup_command_handlers
+from helper import log_command, log_callback, setup_command_handlers, cmd_logger
 from pyrogram.errors import FloodWait
 from ip import IPChecker
+from http_client import HTTPSessionManager
+from geoip import GeoIPDatabase
+from linkstore import LinkStore, MongoLinkStore, canonicalize_url, iter_json_links, iter_log_records
+from cache import TTLCache
+from tokens import TokenSigner, VerificationTokenStore, is_link_token, is_verification_token
+from analytics import ClickCounter, VisitorCounter
 import socket
-import secrets
 import hashlib
 import logging
 import psutil
@@ -64,10 +74,11 @@ try:
     verified_collection = db.verified  # for verified users
     banned_collection = db.banned  # for banned users
     stats_collection = db.stats  # for bot statistics
+    link_clicks_collection = db.link_clicks  # for per-link click counters
     
     # Create indexes
     async def create_indexes():
-        await links_collection.create_index("token", unique=True)
+        await MongoLinkStore(links_collection, link_clicks_collection).create_indexes()
         await users_collection.create_index("user_id", unique=True)
         await verified_collection.create_index("user_id", unique=True)
         await banned_collection.create_index("user_id", unique=True)
@@ -124,6 +135,22 @@ def health():
                 "banned_users": total_banned,
                 "ping_count": PING_COUNT
             },
+            "links": {
+                "store": link_store.get_stats(),
+                "cache": link_cache.get_stats(),
+                "clicks": click_counter.get_stats(),
+                "visitors": visitor_counter.get_stats()
+            },
+            "http": http_manager.get_stats(),
+            "command_log": {
+                "writer": cmd_logger.writer.get_stats(),
+                "store": cmd_logger.store.get_stats()
+            },
+            "verification_tokens": {
+                "mode": VERIFY_TOKEN_MODE,
+                "stored": verification_tokens.get_stats(),
+                "replays_rejected": token_signer.replays_rejected
+            },
             "system_info": {
                 "platform": platform.system(),
                 "platform_release": platform.release(),
@@ -246,39 +273,54 @@ def save_users(users):
 # Initialize users set
 USERS = load_users()
 
+# Shared HTTP connection pool for all outbound calls (started in main())
+http_manager = HTTPSessionManager()
+
 # Initialize IP checker
-ip_checker = IPChecker()
+ip_checker = IPChecker(
+    http=http_manager,
+    geo_cache_size=IP_GEO_CACHE_SIZE,
+    geo_cache_ttl=IP_GEO_CACHE_TTL,
+    user_cache_size=IP_USER_CACHE_SIZE,
+    user_cache_ttl=IP_USER_CACHE_TTL,
+    api_url=IP_API_URL,
+    api_rate_limit=IP_API_RATE_LIMIT,
+    api_queue_size=IP_API_QUEUE_SIZE,
+    api_max_wait=IP_API_MAX_WAIT,
+    banned_collection=banned_collection,
+    verified_collection=verified_collection
+)
 
-# Add this with other global variables
+# Initialize link store and the read-through cache in front of it
+if LINK_STORE == 'file':
+    link_store = LinkStore()
+else:
+    link_store = MongoLinkStore(links_collection, link_clicks_collection)
+link_cache = TTLCache(maxsize=LINK_CACHE_SIZE, ttl=LINK_CACHE_TTL)
+
+# Per-link click counters and unique-visitor sketches, flushed to the link store in batches
+click_counter = ClickCounter()
+visitor_counter = VisitorCounter()
+
+# Signs protected link tokens so bad or expired ones never reach storage
+token_signer = TokenSigner(
+    LINK_TOKEN_SECRET.encode() if LINK_TOKEN_SECRET
+    else hashlib.sha256(f"link-token:{BOT_TOKEN}".encode()).digest()
+)
+
+# Verification tokens are either stateless (signed by token_signer) or live in
+# memory, swept by expiry and snapshotted for restarts
 TOKENS_FILE = 'verification_tokens.json'
+VERIFY_TOKEN_TTL = 600  # 10 minutes
+verification_tokens = VerificationTokenStore(ttl=VERIFY_TOKEN_TTL, snapshot_file=TOKENS_FILE)
 
 def generate_verification_token(user_id: int) -> str:
     """Generate a secure verification token for user"""
     try:
-        # Load or create tokens file
-        try:
-            with open(TOKENS_FILE, 'r') as f:
-                tokens = json.load(f)
-        except:
-            tokens = {}
-        
-        # Generate token
-        random_bytes = secrets.token_bytes(16)
-        current_time = int(time.time())
-        token_data = f"{user_id}:{current_time}:{random_bytes.hex()}"
-        token = hashlib.sha256(token_data.encode()).hexdigest()[:32]
-        
-        # Store token
-        tokens[token] = {
-            "user_id": user_id,
-            "expires": current_time + 600  # 10 minutes
-        }
-        
-        # Save tokens
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(tokens, f)
-        
-        return token
+        if VERIFY_TOKEN_MODE == 'stateless':
+            return token_signer.generate_verification_token(user_id, VERIFY_TOKEN_TTL)
+        # Reuse the user's live token instead of minting a new one
+        return verification_tokens.issue(user_id)
     except Exception as e:
         print(f"Token generation error: {e}")
         return None
@@ -286,29 +328,10 @@ def generate_verification_token(user_id: int) -> str:
 def verify_token(token: str, user_id: int) -> bool:
     """Verify a token is valid for user"""
     try:
-        # Load tokens
-        with open(TOKENS_FILE, 'r') as f:
-            tokens = json.load(f)
-        
-        if token not in tokens:
-            return False
-        
-        token_data = tokens[token]
-        current_time = int(time.time())
-        
-        # Check expiry and user
-        if current_time > token_data["expires"] or token_data["user_id"] != user_id:
-            del tokens[token]
-            with open(TOKENS_FILE, 'w') as f:
-                json.dump(tokens, f)
-            return False
-        
-        # Valid token - remove it
-        del tokens[token]
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(tokens, f)
-        return True
-        
+        # Signed tokens are checked without any storage access, whatever the mode
+        if is_verification_token(token):
+            return token_signer.verify_verification_token(token, user_id)
+        return verification_tokens.verify(token, user_id)
     except Exception as e:
         print(f"Token verification error: {e}")
         return False
@@ -347,8 +370,17 @@ async def start_command(client, message: Message):
         if len(message.command) > 1:
             token = message.command[1]
             
-            # Handle GDV links (v2 tokens)
-            if token.startswith('v2-'):
+            # Handle GDV links (signed v3 and legacy v2 tokens)
+            if is_link_token(token):
+                # Reject forged or expired tokens before anything else
+                if not token_signer.check_link_token(token):
+                    await message.reply(
+                        "❌ This link has expired or is invalid.\n"
+                        "Please request a new link.",
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                    return
+                
                 # First check if user is verified
                 if not ip_checker.is_verified(user_id):
                     # Store the token in user state for after verification
@@ -383,8 +415,10 @@ async def start_command(client, message: Message):
                     return
                 
                 try:
-                    link_data = get_link_data(token)
+                    link_data = await get_link_data(token)
                     if link_data and link_data.get('link'):
+                        click_counter.hit(token)
+                        visitor_counter.add(token, user_id)
                         link = link_data['link']
                         # Check if it's a Telegram link
                         if 't.me/' in link.lower() or 'telegram.me/' in link.lower():
@@ -489,10 +523,10 @@ async def get_user_ip(message: Message) -> str:
         if message.forward_from:
             return message.forward_from.forward_sender_name or "0.0.0.0"
         # Fallback to a default IP check service
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://api.ipify.org?format=json') as response:
-                data = await response.json()
-                return data.get('ip', '0.0.0.0')
+        session = await http_manager.get_session()
+        async with session.get('https://api.ipify.org?format=json') as response:
+            data = await response.json()
+            return data.get('ip', '0.0.0.0')
     except:
         return "0.0.0.0"
 
@@ -520,9 +554,12 @@ async def myip_command(client, message: Message):
         )
         
         # Check if user is allowed (from India)
-        is_allowed, _ = await ip_checker.verify_user(message.from_user.id, user_ip)
+        is_allowed, reason = await ip_checker.verify_user(message.from_user.id, user_ip)
         if is_allowed:
             ip_text += "✅ **Status:** You are allowed to use this bot!"
+        elif reason:
+            # e.g. a deferred check when the lookup service is unavailable
+            ip_text += f"**Status:** {reason}"
         else:
             ip_text += "🚫 **Status:** You are not allowed to use this bot."
         
@@ -543,8 +580,7 @@ async def test_command(client, message: Message):
         await message.reply("🔄 Starting test ban...")
         
         # Add to ban list
-        ip_checker.banned_users.add(message.from_user.id)
-        ip_checker._save_banned_users()
+        ip_checker.ban_user(message.from_user.id)
         
         await message.reply(
             "✅ Test successful!\n\n"
@@ -613,8 +649,10 @@ async def verify_success(client, callback_query: CallbackQuery):
             
             # Process the protected link
             try:
-                link_data = get_link_data(token)
+                link_data = await get_link_data(token)
                 if link_data and link_data.get('link'):
+                    click_counter.hit(token)
+                    visitor_counter.add(token, user_id)
                     link = link_data['link']
                     # Check if it's a Telegram link
                     if 't.me/' in link.lower() or 'telegram.me/' in link.lower():
@@ -658,8 +696,7 @@ async def verify_fail(client, callback_query: CallbackQuery):
         user_id = int(callback_query.data.split('_')[2])
         
         # Ban user
-        ip_checker.banned_users.add(user_id)
-        ip_checker._save_banned_users()
+        ip_checker.ban_user(user_id)
         
         await callback_query.message.edit_text(
             "❌ Verification Failed!\n\n"
@@ -675,77 +712,206 @@ async def verify_fail(client, callback_query: CallbackQuery):
 
 # Add these functions after the imports and before the bot initialization
 def generate_token():
-    """Generate a unique token for the link."""
+    """Generate a unique signed token for the link."""
     try:
-        timestamp = int(time.time())
         # Token valid for 1 year
-        expiry = timestamp + (365 * 24 * 60 * 60)
-        random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-        token_data = f"{timestamp}-{expiry}-{random_str}"
-        # Add v2 prefix to distinguish from verification tokens
-        return f"v2-{base64.urlsafe_b64encode(token_data.encode()).decode()}"
+        expiry = int(time.time()) + (365 * 24 * 60 * 60)
+        return token_signer.generate_link_token(expiry)
     except Exception as e:
         logger.error(f"Token generation error: {e}")
         return None
 
-def save_link(token: str, link: str):
-    """Save link data to JSON file."""
-    try:
-        with open('links.json', 'r') as f:
-            data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = {"links": {}}
+async def save_link(token: str, link: str):
+    """Save link data to the link store."""
+    await save_links([(token, link)])
+
+async def save_links(links):
+    """Save several (token, link) pairs with a single store write."""
+    records = []
+    for token, link in links:
+        # Parse token to get timestamp and expiry
+        parsed = token_signer.parse_link_token(token)
+        if parsed:
+            timestamp, expiry = parsed
+        else:
+            timestamp = int(time.time())
+            expiry = timestamp + (365 * 24 * 60 * 60)  # 1 year default
+        records.append((token, {"link": link, "created_at": int(timestamp), "expires_at": expiry}))
     
-    # Parse token to get timestamp and expiry
-    try:
-        # Remove v2 prefix before decoding
-        pure_token = token.replace('v2-', '', 1)
-        token_data = base64.urlsafe_b64decode(pure_token.encode()).decode()
-        timestamp, expiry, _ = token_data.split('-')
-        expiry = int(expiry)
-    except:
-        timestamp = int(time.time())
-        expiry = timestamp + (365 * 24 * 60 * 60)  # 1 year default
+    await link_store.put_many(records)
+    for token, _ in records:
+        link_cache.pop(token)
+
+async def get_link_data(token: str):
+    """Get link data, served from the cache when the link is hot."""
+    # Forged, mistyped and expired tokens never touch the cache or storage
+    if not token_signer.check_link_token(token):
+        return None
     
-    data["links"][token] = {
-        "link": link,
-        "created_at": int(timestamp),
-        "expires_at": expiry
-    }
+    link_data = link_cache.get(token)
+    if link_data:
+        return link_data
     
-    with open('links.json', 'w') as f:
-        json.dump(data, f, indent=4)
-
-def get_link_data(token: str):
-    """Get link data from JSON file."""
-    try:
-        with open('links.json', 'r') as f:
-            data = json.load(f)
-            link_data = data["links"].get(token)
-            
-            if not link_data:
-                return None
-            
-            # Check if link has expired
-            current_time = int(time.time())
-            if current_time > link_data.get("expires_at", 0):
-                # Remove expired link
-                del data["links"][token]
-                with open('links.json', 'w') as f:
-                    json.dump(data, f, indent=4)
-                return None
-                
-            return link_data
-    except (FileNotFoundError, json.JSONDecodeError):
+    link_data = await link_store.get(token)
+    if not link_data:
+        return None
+    
+    # Check if link has expired
+    current_time = int(time.time())
+    if current_time > link_data.get("expires_at", 0):
+        # Remove expired link
+        await link_store.delete(token)
+        link_cache.pop(token)
         return None
+    
+    # Never cache past the link's own expiry
+    link_cache.set(token, link_data, expires_at=link_data["expires_at"])
+    return link_data
+
+def evict_cached_links(tokens):
+    """Drop swept links from the cache."""
+    for token in tokens:
+        link_cache.pop(token)
+
+# Reuse an existing token for a URL only if it stays valid this long
+TOKEN_REUSE_MIN_REMAINING = 30 * 24 * 60 * 60  # 30 days
+
+async def find_reusable_token(url: str):
+    """Return (token, expires_at) of a live token already protecting this URL, if any."""
+    return await link_store.find_token(url, int(time.time()) + TOKEN_REUSE_MIN_REMAINING)
+
+async def find_reusable_tokens(urls):
+    """Map each URL that has a reusable token to (token, expires_at), in one store query."""
+    return await link_store.find_tokens(urls, int(time.time()) + TOKEN_REUSE_MIN_REMAINING)
 
 # Add this function to handle link generation
 async def generate_protected_link(telegram_link: str) -> str:
-    """Generate a protected link with token."""
+    """Generate a protected link with token, reusing a live one for the same URL."""
+    found = await find_reusable_token(telegram_link)
+    if found:
+        return found[0]
     token = generate_token()
-    save_link(token, telegram_link)
+    await save_link(token, telegram_link)
     return token
 
+# Batch /gdv limits
+MAX_BATCH_LINKS = 500
+MAX_BATCH_FILE_SIZE = 1024 * 1024  # 1 MB
+BATCH_INLINE_LIMIT = 20  # Longer results are sent as a document
+
+def normalize_url(url: str):
+    """Add a scheme if missing; return None for obviously invalid URLs."""
+    url = url.strip()
+    # Basic URL validation
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    if len(url) <= len('https://') or ' ' in url:
+        return None
+    return url
+
+async def read_batch_urls(client, reply: Message):
+    """Read whitespace-separated links from a replied-to text or document."""
+    if reply.document:
+        if reply.document.file_size and reply.document.file_size > MAX_BATCH_FILE_SIZE:
+            return []
+        data = await client.download_media(reply.document, in_memory=True)
+        text = bytes(data.getbuffer()).decode('utf-8', errors='ignore')
+    else:
+        text = reply.text or reply.caption or ""
+    return text.split()
+
+async def protect_links_batch(message: Message, urls):
+    """Protect many links with one token pass, one store write and one reply."""
+    if len(urls) > MAX_BATCH_LINKS:
+        await message.reply(
+            f"❌ **Too many links.** You can protect up to {MAX_BATCH_LINKS} links at once.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    results = []
+    new_links = []
+    invalid = []
+    seen = {}
+    reused = 0
+    earliest_reused = None  # earliest expiry among reused tokens
+    candidates = []
+    for raw_url in urls:
+        url = normalize_url(raw_url)
+        if not url:
+            invalid.append(raw_url)
+            continue
+        try:
+            candidates.append((url, canonicalize_url(url)))
+        except ValueError:
+            # e.g. a non-numeric or out-of-range port
+            invalid.append(raw_url)
+    
+    # One lookup for every URL that already has a live token
+    stored = await find_reusable_tokens({url for url, _ in candidates})
+    
+    for url, key in candidates:
+        # Reuse tokens for repeated URLs, in this batch or already stored
+        token = seen.get(key)
+        if not token:
+            found = stored.get(url)
+            if found:
+                token, expires_at = found
+                reused += 1
+                earliest_reused = min(expires_at, earliest_reused or expires_at)
+            else:
+                token = generate_token()
+                if not token:
+                    invalid.append(url)
+                    continue
+                new_links.append((token, url))
+            seen[key] = token
+        results.append((url, token))
+    
+    if not results:
+        await message.reply(
+            "❌ **Invalid URL Format**\n"
+            "Example: `/gdv https://example.com` or\n"
+            "Example: `/gdv t.me/mrgadhvii`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    # One batched write for the whole list
+    await save_links(new_links)
+    
+    share_links = [
+        (url, f"https://telegram.dog/{BOT_USERNAME}?start={token}")
+        for url, token in results
+    ]
+    summary = f"✅ **{len(share_links)} Protected Links Generated!**\n"
+    if new_links:
+        summary += "• New links valid for 1 year\n"
+    if reused:
+        summary += (
+            f"• Reused {reused} existing protected link(s), valid until at least "
+            f"{datetime.fromtimestamp(earliest_reused):%d %b %Y}\n"
+        )
+    if invalid:
+        summary += f"• Skipped {len(invalid)} invalid link(s)\n"
+    
+    if len(share_links) <= BATCH_INLINE_LIMIT:
+        lines = [f"{i}. `{url}`\n🔗 `{share_link}`" for i, (url, share_link) in enumerate(share_links, 1)]
+        await message.reply(
+            summary + "\n" + "\n\n".join(lines),
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True
+        )
+        return
+    
+    document = io.BytesIO("\n".join(f"{url}\t{share_link}" for url, share_link in share_links).encode())
+    document.name = "protected_links.txt"
+    await message.reply_document(
+        document,
+        caption=summary,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
 @app.on_message(filters.command("gdv"))
 @log_command
 async def gdv_command(client, message: Message):
@@ -770,27 +936,40 @@ async def gdv_command(client, message: Message):
             )
             return
             
+        # Collect links from the command, or from a replied-to text/document
+        urls = message.command[1:]
+        if not urls and message.reply_to_message:
+            urls = await read_batch_urls(client, message.reply_to_message)
+        
+        # Several links: protect them all in one pass
+        if len(urls) > 1:
+            await protect_links_batch(message, urls)
+            return
+        
         # Check if command has a link
-        if len(message.command) > 1:
-            url = message.command[1]
-            
-            # Basic URL validation
-            if not url.startswith(('http://', 'https://')):
-                url = 'https://' + url
+        if urls:
+            url = normalize_url(urls[0])
             
             try:
                 # Additional URL validation could be added here
-                if len(url) < 4:  # Simple length check
+                if not url:
                     raise ValueError("Invalid URL")
                     
-                # Generate token and save link
-                token = generate_token()
-                if not token:
-                    await message.reply("⚠️ Error generating link. Please try again.")
-                    return
-                
-                # Save link using save_link function
-                save_link(token, url)
+                # Reuse a live token for the same URL instead of growing the store
+                found = await find_reusable_token(url)
+                if found:
+                    token, expires_at = found
+                    validity = f"Valid until {datetime.fromtimestamp(expires_at):%d %b %Y}"
+                else:
+                    validity = "Valid for 1 year"
+                    # Generate token and save link
+                    token = generate_token()
+                    if not token:
+                        await message.reply("⚠️ Error generating link. Please try again.")
+                        return
+                    
+                    # Save link using save_link function
+                    await save_link(token, url)
                 
                 # Create shareable link using telegram.dog
                 share_link = f"https://telegram.dog/{BOT_USERNAME}?start={token}"
@@ -807,7 +986,7 @@ async def gdv_command(client, message: Message):
                     "✅ **Protected Link Generated!**\n\n"
                     f"🔗 Your link: `{share_link}`\n\n"
                     "📝 **Link Details:**\n"
-                    "• Valid for 1 year\n"
+                    f"• {validity}\n"
                     f"• Type: {'Telegram Channel/Group' if is_telegram_link else 'External Website'}\n"
                     "🔄 Use the button below to share",
                     reply_markup=keyboard,
@@ -825,7 +1004,8 @@ async def gdv_command(client, message: Message):
             await message.reply(
                 "❌ **Please provide a URL to protect**\n"
                 "Example: `/gdv https://example.com` or\n"
-                "Example: `/gdv t.me/mrgadhvii`",
+                "Example: `/gdv t.me/mrgadhvii`\n\n"
+                "__Send several links (one per line), or reply to a text/file of links, to protect them all at once.__",
                 parse_mode=ParseMode.MARKDOWN
             )
     except Exception as e:
@@ -841,16 +1021,15 @@ async def shorten_url(url: str) -> str:
         "format": "json"
     }
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(api_url, params=params) as response:
-            data = await response.json()
-            return data.get("result", {}).get("short_url", url)
+    session = await http_manager.get_session()
+    async with session.get(api_url, params=params) as response:
+        data = await response.json()
+        return data.get("result", {}).get("short_url", url)
 
 async def create_share_button(telegram_link: str, caption: str = None) -> str:
     """Create share text with optional caption."""
     # Generate token for the link
-    token = generate_token()
-    save_link(token, telegram_link)
+    token = await generate_protected_link(telegram_link)
     
     # Create bot link with token
     bot_link = f"https://t.me/{BOT_USERNAME}?start={token}"
@@ -884,7 +1063,7 @@ def create_channel_keyboard():
         ])
     return InlineKeyboardMarkup(keyboard)
 
-@app.on_message(filters.private & filters.text & ~filters.command(["start", "gdv", "help", "skip", "broadcast", "broadcat"]))
+@app.on_message(filters.private & filters.text & ~filters.command(["start", "gdv", "help", "skip", "broadcast", "broadcat", "migratelinks", "topclicks", "linkstats", "banrange", "unbanrange", "loadranges", "reaudit", "usage"]))
 @log_command
 async def handle_caption(client, message: Message):
     """Handle caption input"""
@@ -1382,18 +1561,52 @@ async def broadcast_command(client, message: Message):
 async def ip_stats_command(client, message: Message):
     """Show IP verification statistics"""
     try:
-        stats = ip_checker.get_stats()
+        # Optional: /ipstats [top_k]
+        top_k = int(message.command[1]) if len(message.command) > 1 and message.command[1].isdigit() else 10
+        stats = ip_checker.get_stats(top_k=top_k)
         stats_text = (
             "📊 **IP Verification Statistics**\n\n"
             f"👥 Total Users Checked: `{stats['total_checked']}`\n"
-            f"🚫 Total Banned Users: `{stats['total_banned']}`\n\n"
-            "🌍 **Users by Country:**\n"
+            f"🚫 Total Banned Users: `{stats['total_banned']}`\n"
+            f"✅ Pass Ratio: `{stats['pass_ratio']:.1%}`\n\n"
+            f"🌍 **Top {top_k} Countries:**\n"
         )
         
         # Add country statistics
         for country, count in stats['countries'].items():
             stats_text += f"• {country}: `{count}`\n"
         
+        # Recent checks
+        for label, window in (("Last Hour", stats['last_hour']), ("Last Day", stats['last_day'])):
+            stats_text += (
+                f"\n🕒 **{label}:** `{window['passed']}` passed, `{window['failed']}` failed, "
+                f"`{window['deferred']}` deferred (pass ratio `{window['pass_ratio']:.1%}`)\n"
+            )
+            top = ", ".join(f"{country} `{count}`" for country, count in list(window['countries'].items())[:5])
+            if top:
+                stats_text += f"   {top}\n"
+        
+        # Lookup latency
+        stats_text += "\n⏱️ **Lookup Latency (p50/p90/p99 ms):**\n"
+        for source, latency in stats['latency_ms'].items():
+            stats_text += f"• {source}: `{latency['p50']}` / `{latency['p90']}` / `{latency['p99']}`\n"
+        
+        stats_text += (
+            f"\n🛰️ Offline checks: `{stats['offline_checks']}` | API checks: `{stats['api_checks']}`\n"
+            f"🔗 Coalesced lookups: `{stats['coalesced_lookups']}` | "
+            f"Serialized user checks: `{stats['serialized_verifications']}`\n"
+            f"🧱 Banned ranges: `{stats['banned_ranges']['networks']}` "
+            f"(`{stats['range_blocks']}` requests refused)\n"
+            f"⏳ Deferred checks: `{stats['deferred_checks']}` | "
+            f"API budget left: `{stats['rate_limiter']['tokens']}` "
+            f"(`{stats['rate_limiter']['waiting']}` queued, `{stats['rate_limiter']['rejected']}` rejected)\n"
+            "\n🗄️ **Caches:**\n"
+            f"• Geo (by IP): `{stats['geo_cache']['size']}` entries, "
+            f"hit ratio `{stats['geo_cache']['hit_ratio']:.1%}`\n"
+            f"• User verdicts: `{stats['user_cache']['size']}` entries, "
+            f"hit ratio `{stats['user_cache']['hit_ratio']:.1%}`\n"
+        )
+        
         await message.reply(stats_text, parse_mode=ParseMode.MARKDOWN)
     except Exception as e:
         print(f"Stats error: {str(e)}")
@@ -1419,8 +1632,7 @@ async def ban_command(client, message: Message):
             return
         
         # Ban user
-        ip_checker.banned_users.add(user_id)
-        ip_checker._save_banned_users()
+        ip_checker.ban_user(user_id)
         await message.reply(f"Banned user: {user_id}")
         
     except Exception as e:
@@ -1446,9 +1658,7 @@ async def unban_command(client, message: Message):
             return
         
         # Unban user
-        if user_id in ip_checker.banned_users:
-            ip_checker.banned_users.remove(user_id)
-            ip_checker._save_banned_users()
+        if ip_checker.unban_user(user_id):
             await message.reply(f"Unbanned user: {user_id}")
         else:
             await message.reply(f"User {user_id} is not banned")
@@ -1456,6 +1666,259 @@ async def unban_command(client, message: Message):
     except Exception as e:
         await message.reply(f"Error: {str(e)}")
 
+MAX_RANGE_FILE_SIZE = 20 * 1024 * 1024  # bytes
+
+@app.on_message(filters.command("banrange") & filters.user(7029363479))
+async def ban_range_command(client, message: Message):
+    """Ban one or more IP ranges (CIDR) - Admin only"""
+    try:
+        if len(message.command) < 2:
+            await message.reply("Use: /banrange [cidr] [cidr ...]")
+            return
+        
+        added, invalid = await ip_checker.ban_ranges(message.command[1:])
+        reply = f"Banned {added} new range(s). Total: {len(ip_checker.banned_ranges)}"
+        if invalid:
+            reply += f"\nInvalid: {', '.join(invalid[:10])}"
+        await message.reply(reply)
+        
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+
+@app.on_message(filters.command("unbanrange") & filters.user(7029363479))
+async def unban_range_command(client, message: Message):
+    """Remove a banned IP range - Admin only"""
+    try:
+        if len(message.command) != 2:
+            await message.reply("Use: /unbanrange [cidr]")
+            return
+        
+        try:
+            removed = await ip_checker.unban_range(message.command[1])
+        except ValueError:
+            await message.reply("Invalid range")
+            return
+        
+        if removed:
+            await message.reply(f"Unbanned range: {message.command[1]}")
+        else:
+            await message.reply(f"Range {message.command[1]} is not banned")
+        
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+
+@app.on_message(filters.command("loadranges") & filters.user(7029363479))
+async def load_ranges_command(client, message: Message):
+    """Bulk-ban IP ranges from a replied-to file, one CIDR per line - Admin only"""
+    try:
+        reply = message.reply_to_message
+        if not reply or not reply.document:
+            await message.reply("Reply to a text file with one CIDR per line (# comments allowed) using /loadranges")
+            return
+        if reply.document.file_size and reply.document.file_size > MAX_RANGE_FILE_SIZE:
+            await message.reply("❌ File is too large.")
+            return
+        
+        status = await message.reply("🔄 Loading ranges...")
+        data = await client.download_media(reply.document, in_memory=True)
+        lines = bytes(data.getbuffer()).decode('utf-8', errors='ignore').splitlines()
+        added, invalid = await ip_checker.ban_ranges(lines)
+        
+        stats = ip_checker.banned_ranges.get_stats()
+        await status.edit_text(
+            f"✅ Banned {added} new range(s) from {len(lines)} lines.\n"
+            f"Invalid entries: {len(invalid)}\n"
+            f"Total ranges: {stats['networks']} "
+            f"({stats['ipv4_intervals']} IPv4 / {stats['ipv6_intervals']} IPv6 intervals)"
+        )
+        
+    except Exception as e:
+        await message.reply(f"Error: {str(e)}")
+
+@app.on_message(filters.command("reaudit") & filters.user(7029363479))
+async def reaudit_command(client, message: Message):
+    """Re-check all verified users' last IPs against the GeoIP database - Admin only"""
+    try:
+        if ip_checker.geoip is None:
+            await message.reply("❌ GeoIP database is not loaded.")
+            return
+        
+        status = await message.reply("🔄 Re-auditing verified users...")
+        report = await ip_checker.reaudit()
+        
+        text = (
+            "🔎 **Re-audit Complete**\n\n"
+            f"👥 Audited: `{report['audited']}` of `{report['verified']}` verified "
+            "(only users with a recorded IP)\n"
+            f"🔀 Country changed: `{report['changed']}`\n"
+            f"🆕 First audit: `{report['baselined']}`\n"
+            f"🔁 Queued for re-verification: `{report['queued']}`\n"
+            f"🛰️ Outside GeoIP: `{report['uncovered']}` (`{report['api_resolved']}` checked via API)\n"
+            f"⚡ `{report['users_per_second']:,}` users/s ({report['engine']}), "
+            f"total `{report['total_seconds']:.2f}s`\n"
+        )
+        if report['changes']:
+            text += "\n**Changes:**\n"
+            for user_id, previous, country in report['changes']:
+                text += f"• `{user_id}`: {previous} → {country}\n"
+        await status.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+        
+    except Exception as e:
+        logger.error(f"Re-audit error: {e}")
+        await message.reply(f"Error: {str(e)}")
+
+def get_link_migration_source():
+    """Return the local link file to migrate into MongoDB, if any."""
+    for source in ('links.log', 'links.json'):
+        if os.path.exists(source):
+            return source
+    return None
+
+async def migrate_links(status: Message = None):
+    """Stream local links into the Mongo link store in chunks."""
+    source = get_link_migration_source()
+    if not source:
+        return 0
+    
+    records = iter_log_records(source) if source.endswith('.log') else iter_json_links(source)
+    logger.info(f"Migrating links from {source} to MongoDB")
+    total = 0
+    async for total in link_store.import_records(records):
+        if status and total % 10000 == 0:
+            try:
+                await status.edit(f"🚚 **Migrating links...**\n\n**Records:** `{total}`")
+            except:
+                pass
+    
+    folded = await link_store.dedupe()
+    logger.info(f"Migrated {total} link records from {source} ({folded} duplicates folded)")
+    return total
+
+@app.on_message(filters.command("migratelinks") & filters.user(7029363479))
+async def migrate_links_command(client, message: Message):
+    """Stream links.log/links.json into MongoDB - Admin only"""
+    try:
+        if not isinstance(link_store, MongoLinkStore):
+            await message.reply("❌ Link store is file-backed. Set `LINK_STORE=mongo` first.")
+            return
+        
+        source = get_link_migration_source()
+        if not source:
+            await message.reply("❌ No local links file found.")
+            return
+        
+        status = await message.reply(f"🚚 **Migrating links from** `{source}`...")
+        total = await migrate_links(status)
+        await status.edit(
+            "✅ **Link Migration Completed!**\n\n"
+            f"**Source:** `{source}`\n"
+            f"**Records:** `{total}`"
+        )
+    except Exception as e:
+        logger.error(f"Link migration error: {e}")
+        await message.reply(f"❌ Migration failed: `{e}`")
+
+@app.on_message(filters.command("topclicks") & filters.user(7029363479))
+async def top_clicks_command(client, message: Message):
+    """Show the most clicked protected links - Admin only"""
+    try:
+        # Usage: /topclicks [hours] [count]
+        hours = int(message.command[1]) if len(message.command) > 1 else 24
+        limit = min(int(message.command[2]) if len(message.command) > 2 else 10, 50)
+        
+        # Make sure buffered clicks are included
+        await click_counter.flush(link_store)
+        since = (int(time.time()) - hours * 3600) // click_counter.bucket_seconds
+        top = await link_store.top_clicks(since, limit)
+        
+        if not top:
+            await message.reply(f"📊 No clicks in the last {hours}h.")
+            return
+        
+        stats_text = f"📊 **Top {len(top)} Links (last {hours}h)**\n\n"
+        for i, (token, clicks) in enumerate(top, 1):
+            stats_text += f"{i}. `{token}` — `{clicks}` clicks\n"
+        await message.reply(stats_text, parse_mode=ParseMode.MARKDOWN)
+    except ValueError:
+        await message.reply("Use: /topclicks [hours] [count]")
+    except Exception as e:
+        logger.error(f"Top clicks error: {e}")
+        await message.reply("⚠️ Error getting click statistics.")
+
+# /usage periods -> (counter resolution, buckets)
+USAGE_PERIODS = {"hour": ("minute", 60), "day": ("hour", 24), "month": ("day", 30)}
+
+@app.on_message(filters.command("usage") & filters.user(7029363479))
+async def usage_command(client, message: Message):
+    """Show command and callback usage over a recent period - Admin only"""
+    try:
+        # Usage: /usage [hour|day|month] [count]
+        period = message.command[1].lower() if len(message.command) > 1 else "hour"
+        limit = min(int(message.command[2]) if len(message.command) > 2 else 10, 50)
+        if period not in USAGE_PERIODS:
+            raise ValueError(period)
+        resolution, buckets = USAGE_PERIODS[period]
+        
+        usage = cmd_logger.usage
+        window = usage.window(resolution, buckets)
+        series = [count for _, count in usage.commands.series(resolution)][-buckets:]
+        peak = max(series) if series else 0
+        bars = "▁▂▃▄▅▆▇█"
+        sparkline = "".join(bars[count * 7 // peak] if peak else bars[0] for count in series)
+        
+        stats_text = (
+            f"📊 **Usage (last {period})**\n\n"
+            f"⌨️ Commands: `{window['total_commands']}`\n"
+            f"🔘 Callbacks: `{window['total_callbacks']}`\n"
+            f"👥 Unique users: `~{window['unique_users']}`\n\n"
+            f"📈 **Commands per {resolution}** (peak `{peak}`):\n`{sparkline}`\n"
+        )
+        for title, frequency in (("Commands", window['command_frequency']),
+                                 ("Callbacks", window['callback_frequency'])):
+            top = frequency.most_common(limit)
+            if top:
+                stats_text += f"\n🏆 **Top {title}:**\n"
+                stats_text += "".join(f"• `{key}`: `{count}`\n" for key, count in top)
+        await message.reply(stats_text, parse_mode=ParseMode.MARKDOWN)
+    except ValueError:
+        await message.reply("Use: /usage [hour|day|month] [count]")
+    except Exception as e:
+        logger.error(f"Usage stats error: {e}")
+        await message.reply("⚠️ Error getting usage statistics.")
+
+@app.on_message(filters.command("linkstats") & filters.user(7029363479))
+async def link_stats_command(client, message: Message):
+    """Show clicks and estimated unique visitors of a link - Admin only"""
+    try:
+        # Usage: /linkstats <token> [days]
+        if len(message.command) < 2:
+            await message.reply("Use: /linkstats [token] [days]")
+            return
+        token = message.command[1].split("start=")[-1]
+        days = int(message.command[2]) if len(message.command) > 2 else 7
+        
+        now = int(time.time())
+        await click_counter.flush(link_store)
+        clicks = await link_store.token_clicks(token, (now - days * 86400) // click_counter.bucket_seconds)
+        since_day = (now - (days - 1) * 86400) // visitor_counter.bucket_seconds
+        window_visitors = await visitor_counter.estimate(link_store, token, since_day)
+        total_visitors = await visitor_counter.estimate(link_store, token)
+        
+        await message.reply(
+            f"📈 **Link Statistics**\n\n"
+            f"🔗 Token: `{token}`\n"
+            f"👆 Clicks (last {days}d): `{clicks}`\n"
+            f"👥 Unique users (last {days}d): `~{window_visitors}`\n"
+            f"👥 Unique users (all time): `~{total_visitors}`\n\n"
+            "__Unique counts are estimates (±2.3%).__",
+            parse_mode=ParseMode.MARKDOWN
+        )
+    except ValueError:
+        await message.reply("Use: /linkstats [token] [days]")
+    except Exception as e:
+        logger.error(f"Link stats error: {e}")
+        await message.reply("⚠️ Error getting link statistics.")
+
 async def send_ping():
     """Send ping message to admin."""
     global PING_COUNT
@@ -1521,6 +1984,26 @@ async def shutdown(signal, loop):
 async def main():
     """Main function to run the bot"""
     try:
+        # Start the shared HTTP connection pool before any handler can run
+        await http_manager.start()
+        
+        # Load banned/verified users before any handler can check them
+        await ip_checker.load_user_lists()
+        asyncio.create_task(ip_checker.run_user_list_flusher())
+        
+        # Load the offline IP range database (checks fall back to ip-api.com without it)
+        if GEOIP_CSV:
+            try:
+                ip_checker.geoip = await asyncio.to_thread(GeoIPDatabase.load, GEOIP_CSV)
+            except FileNotFoundError:
+                logger.warning(f"GeoIP database {GEOIP_CSV} not found, using ip-api.com only")
+            except Exception as e:
+                logger.error(f"Error loading GeoIP database: {e}")
+        
+        # Periodically re-audit verified users against the GeoIP database
+        if REAUDIT_INTERVAL > 0:
+            asyncio.create_task(ip_checker.run_reaudit(REAUDIT_INTERVAL))
+        
         # Start the bot
         await app.start()
         logger.info("Bot started successfully!")
@@ -1542,6 +2025,24 @@ async def main():
         
         # Start ping service
         asyncio.create_task(send_ping())
+        
+        # Start verification token sweeping
+        asyncio.create_task(verification_tokens.run_sweeper())
+        
+        # Start click counter flushing
+        asyncio.create_task(click_counter.run_flusher(link_store))
+        asyncio.create_task(visitor_counter.run_flusher(link_store))
+        
+        if LINK_STORE == 'file':
+            # Fold duplicate links minted before URL dedup existed (no-op afterwards)
+            await link_store.dedupe()
+            
+            # Start link store compaction and expiry sweeping
+            asyncio.create_task(link_store.run_compaction())
+            asyncio.create_task(link_store.run_expiry_sweeper(on_evict=evict_cached_links))
+        elif await link_store.count() == 0 and get_link_migration_source():
+            # Mongo handles expiry itself; just bring over local links on first run
+            asyncio.create_task(migrate_links())
         logger.info("Services started")
         logger.info("Bot is running...")
         
@@ -1551,6 +2052,25 @@ async def main():
         logger.error(f"Error in main: {e}", exc_info=True)
     finally:
         logger.info("Stopping bot...")
+        try:
+            await click_counter.flush(link_store)
+            await visitor_counter.flush(link_store)
+        except Exception as e:
+            logger.error(f"Error flushing link analytics: {e}")
+        try:
+            await verification_tokens.snapshot()
+        except Exception as e:
+            logger.error(f"Error saving verification tokens: {e}")
+        try:
+            await cmd_logger.close()
+        except Exception as e:
+            logger.error(f"Error flushing command logs: {e}")
+        try:
+            await ip_checker.flush_user_lists()
+        except Exception as e:
+            logger.error(f"Error saving user lists: {e}")
+        link_store.close()
+        await http_manager.close()
         await app.stop()
 
 if __name__ == "__main__":
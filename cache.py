@@ -0,0 +1,116 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after a TTL.
+
+    Each entry may be given its own deadline (for example a link's
+    ``expires_at``); the effective deadline is whichever comes first.
+    ``on_evict(key, value)``, if given, is called whenever an entry leaves
+    the cache (eviction, expiry, overwrite, pop or clear), so callers can
+    keep aggregates over the cached values up to date.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value and mark it recently used"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, deadline = entry
+        if time.time() >= deadline:
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None,
+            expires_at: Optional[float] = None):
+        """Cache a value, evicting the least recently used entry when full"""
+        deadline = time.time() + (self.ttl if ttl is None else ttl)
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        old = self._data.get(key)
+        if old is not None:
+            self._data.move_to_end(key)
+        self._data[key] = (value, deadline)
+        if old is not None and self.on_evict is not None:
+            self.on_evict(key, old[0])
+        while len(self._data) > self.maxsize:
+            evicted_key, (evicted, _) = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Invalidate a key, returning its value if it was cached"""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        if self.on_evict is not None:
+            self.on_evict(key, entry[0])
+        return entry[0]
+
+    def clear(self):
+        entries, self._data = self._data, OrderedDict()
+        if self.on_evict is not None:
+            for key, (value, _) in entries.items():
+                self.on_evict(key, value)
+
+    def expire(self) -> int:
+        """Drop every expired entry now (one pass over the cache); returns how many"""
+        now = time.time()
+        expired = [key for key, (_, deadline) in self._data.items() if now >= deadline]
+        for key in expired:
+            value, _ = self._data.pop(key)
+            self.expirations += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+        return len(expired)
+
+    def items(self):
+        """Live (key, value) pairs, oldest first; does not touch LRU order or counters"""
+        now = time.time()
+        return [(key, value) for key, (value, deadline) in self._data.items() if now < deadline]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and time.time() < entry[1]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict:
+        """Get cache hit/miss/eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight task.
+
+    The first caller starts the work; callers that arrive while it is still
+    running await the same task and get the same result or exception. A
+    cancelled caller does not cancel the shared work.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._calls.pop(key, None) if self._calls.get(key) is t else None)
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on demand and dropped once nobody
+    holds or waits for it, so idle keys cost no memory.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}  # key -> [lock, holders + waiters]
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        if entry[0].locked():
+            self.contended += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter with a bounded priority wait queue.
+
+    Admits at most ``limit`` requests in any ``window`` seconds: ``burst``
+    can go out at once and the rest trickle in at an even rate. Callers
+    that find the bucket empty wait in a queue ordered by priority (lower
+    first), then arrival. When the queue is full, or a caller would wait
+    longer than its timeout, ``acquire`` returns False instead of blocking.
+    """
+
+    def __init__(self, limit: int = 45, window: float = 60, burst: int = 5, max_waiters: int = 100):
+        self.capacity = max(1, min(burst, limit))
+        self.rate = max(limit - self.capacity, 1) / window
+        self.max_waiters = max_waiters
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_take(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds: float):
+        """Stop admitting until the provider's window resets (e.g. it said 0 remaining)"""
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, priority: int = 0, timeout: float = 10) -> bool:
+        """Take one request slot, waiting at most ``timeout`` seconds"""
+        if not self._waiters and self._try_take():
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_waiters:
+            self.rejected += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            # Leave the entry in the heap; the dispatcher skips cancelled futures.
+            # If the slot was granted in the same tick, keep it.
+            if future.cancel():
+                self.timed_out += 1
+                return False
+        self.admitted += 1
+        return True
+
+    async def _dispatch(self):
+        waiters = self._waiters
+        while waiters:
+            if waiters[0][2].done():
+                heapq.heappop(waiters)
+                continue
+            if self._try_take():
+                heapq.heappop(waiters)[2].set_result(True)
+                continue
+            now = time.monotonic()
+            delay = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.001)
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict:
+        """Get limiter counters and current budget"""
+        self._refill(time.monotonic())
+        return {
+            'tokens': round(self.tokens, 2),
+            'waiting': sum(1 for _, _, f in self._waiters if not f.done()),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'paused': self.paused_until > time.monotonic()
+        }
@@ -8,4 +8,41 @@ load_dotenv()
 API_ID = os.getenv('API_ID')
 API_HASH = os.getenv('API_HASH')
 BOT_TOKEN = os.getenv('BOT_TOKEN') 
-MONGO_URL = os.getenv('MONGO_URL')
\ No newline at end of file
+MONGO_URL = os.getenv('MONGO_URL')
+
+# Protected link cache
+LINK_CACHE_SIZE = int(os.getenv('LINK_CACHE_SIZE', 10000))
+LINK_CACHE_TTL = int(os.getenv('LINK_CACHE_TTL', 300))  # seconds
+
+# Secret for signing protected link tokens (derived from BOT_TOKEN if unset)
+LINK_TOKEN_SECRET = os.getenv('LINK_TOKEN_SECRET')
+
+# Link storage backend: "mongo" (shared links collection) or "file" (local links.log)
+LINK_STORE = os.getenv('LINK_STORE', 'mongo').lower()
+
+# Verification tokens: "stateless" (signed, no storage) or "stored" (in-memory table)
+VERIFY_TOKEN_MODE = os.getenv('VERIFY_TOKEN_MODE', 'stateless').lower()
+
+# IP checker caches: geolocation by IP and per-user verdicts (TTL in seconds)
+IP_GEO_CACHE_SIZE = int(os.getenv('IP_GEO_CACHE_SIZE', 50000))
+IP_GEO_CACHE_TTL = int(os.getenv('IP_GEO_CACHE_TTL', 21600))
+IP_USER_CACHE_SIZE = int(os.getenv('IP_USER_CACHE_SIZE', 50000))
+IP_USER_CACHE_TTL = int(os.getenv('IP_USER_CACHE_TTL', 86400))
+
+# Offline IP range database (CSV: start,end,country); empty to use ip-api.com only
+GEOIP_CSV = os.getenv('GEOIP_CSV', 'geoip.csv')
+
+# ip-api.com provider (point IP_API_URL at a local stand-in for testing)
+IP_API_URL = os.getenv('IP_API_URL', 'http://ip-api.com/json/')
+IP_API_RATE_LIMIT = int(os.getenv('IP_API_RATE_LIMIT', 45))  # requests per minute
+IP_API_QUEUE_SIZE = int(os.getenv('IP_API_QUEUE_SIZE', 100))
+IP_API_MAX_WAIT = float(os.getenv('IP_API_MAX_WAIT', 10))  # seconds a lookup may queue
+
+# Re-audit of verified users' last IPs against the GeoIP database (seconds, 0 disables)
+REAUDIT_INTERVAL = int(os.getenv('REAUDIT_INTERVAL', 86400))
+
+# Command/callback usage log: segment rotation (bytes, seconds) and retention (days, 0 keeps all)
+COMMAND_LOG_DIR = os.getenv('COMMAND_LOG_DIR', 'logs')
+COMMAND_LOG_SEGMENT_BYTES = int(os.getenv('COMMAND_LOG_SEGMENT_BYTES', 4 * 1024 * 1024))
+COMMAND_LOG_SEGMENT_AGE = int(os.getenv('COMMAND_LOG_SEGMENT_AGE', 86400))
+COMMAND_LOG_RETENTION_DAYS = int(os.getenv('COMMAND_LOG_RETENTION_DAYS', 30))
@@ -0,0 +1,251 @@
+import csv
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional: batch lookups fall back to bisect
+    np = None
+
+logger = logging.getLogger('GeoIP')
+
+_MAGIC = b'GEOIP1' + (b'LE' if sys.byteorder == 'little' else b'BE')
+_HEADER = struct.Struct('<8sIII')  # magic, v4 ranges, v6 ranges, countries blob size
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _parse_ip(value: str) -> Tuple[int, int]:
+    """Return (version, integer) for an address given as text or as an integer"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 1 << 32 else 6), number
+    address = ipaddress.ip_address(value)
+    return address.version, int(address)
+
+
+class GeoIPDatabase:
+    """
+    Offline IP-range -> country lookup.
+
+    Ranges are kept in sorted, non-overlapping arrays and resolved with a
+    binary search, so a lookup costs a few microseconds and no I/O. IPv4
+    ranges use 32-bit bounds; IPv6 ranges are indexed on the upper 64 bits
+    (the routing prefix, which is all country allocations use).
+
+    The CSV is parsed once into a binary file next to it
+    (``<csv>.bin``); later starts mmap that file and search it in place.
+    """
+
+    def __init__(self, v4_starts, v4_ends, v4_countries, v6_starts, v6_ends, v6_countries,
+                 countries: List[str], source: str = None, mapped: mmap.mmap = None):
+        self.v4_starts = v4_starts
+        self.v4_ends = v4_ends
+        self.v4_countries = v4_countries
+        self.v6_starts = v6_starts
+        self.v6_ends = v6_ends
+        self.v6_countries = v6_countries
+        self.countries = countries
+        self.source = source
+        self._mapped = mapped
+        self.load_ms = 0.0
+        self.lookups = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, csv_path: str) -> 'GeoIPDatabase':
+        """Load the range table, rebuilding the binary cache if the CSV is newer"""
+        started = time.perf_counter()
+        bin_path = f"{csv_path}.bin"
+        try:
+            fresh = os.path.getmtime(bin_path) >= os.path.getmtime(csv_path)
+        except FileNotFoundError:
+            fresh = os.path.exists(bin_path) and not os.path.exists(csv_path)
+        db = None
+        if fresh:
+            try:
+                db = cls.from_binary(bin_path)
+            except ValueError as e:
+                logger.warning(f"Ignoring GeoIP cache {bin_path}: {e}")
+        if db is None:
+            db = cls.from_csv(csv_path)
+            db.save_binary(bin_path)
+        db.source = csv_path
+        db.load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Loaded {len(db.v4_starts)} IPv4 and {len(db.v6_starts)} IPv6 ranges "
+                    f"in {db.load_ms:.1f}ms")
+        return db
+
+    @classmethod
+    def from_csv(cls, csv_path: str) -> 'GeoIPDatabase':
+        """
+        Parse ``start,end,country[,country_name]`` rows. Bounds may be
+        addresses or integers; the last column is used as the country.
+        """
+        country_ids: Dict[str, int] = {}
+        ranges = {4: [], 6: []}
+        with open(csv_path, 'r', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'):
+                    continue
+                try:
+                    version, start = _parse_ip(row[0])
+                    _, end = _parse_ip(row[1])
+                except ValueError:
+                    continue  # header or malformed row
+                country = row[-1].strip()
+                if not country or country == '-':
+                    continue
+                if version == 6:
+                    start, end = start >> 64, end >> 64
+                cid = country_ids.setdefault(country, len(country_ids))
+                ranges[version].append((start, end, cid))
+
+        tables = []
+        for version, typecode in ((4, 'I'), (6, 'Q')):
+            starts, ends, cids = array(typecode), array(typecode), array('H')
+            for start, end, cid in sorted(ranges[version]):
+                if ends and start <= ends[-1]:
+                    # Overlap: the earlier range wins, keep only the uncovered tail
+                    if end <= ends[-1]:
+                        continue
+                    start = ends[-1] + 1
+                if ends and cids[-1] == cid and start == ends[-1] + 1:
+                    ends[-1] = end  # Merge adjacent ranges of the same country
+                    continue
+                starts.append(start)
+                ends.append(end)
+                cids.append(cid)
+            tables.extend((starts, ends, cids))
+        return cls(*tables, countries=list(country_ids))
+
+    def save_binary(self, bin_path: str):
+        """Write the arrays to a binary file that ``from_binary`` can mmap"""
+        countries_blob = json.dumps(self.countries).encode()
+        tmp_path = f"{bin_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            header = _HEADER.pack(_MAGIC, len(self.v4_starts), len(self.v6_starts), len(countries_blob))
+            f.write(header + b'\0' * (_pad8(len(header)) - len(header)))
+            for section in (self.v4_starts, self.v4_ends, self.v4_countries,
+                            self.v6_starts, self.v6_ends, self.v6_countries):
+                data = section.tobytes()
+                f.write(data + b'\0' * (_pad8(len(data)) - len(data)))
+            f.write(countries_blob)
+        os.replace(tmp_path, bin_path)
+
+    @classmethod
+    def from_binary(cls, bin_path: str) -> 'GeoIPDatabase':
+        """Map a binary range file; the arrays are views into the mapping"""
+        with open(bin_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) < _HEADER.size:
+            raise ValueError("truncated file")
+        magic, n4, n6, blob_size = _HEADER.unpack_from(mapped)
+        if magic != _MAGIC:
+            raise ValueError("bad magic or byte order")
+        view = memoryview(mapped)
+        offset = _pad8(_HEADER.size)
+        sections = []
+        for count, typecode, width in ((n4, 'I', 4), (n4, 'I', 4), (n4, 'H', 2),
+                                       (n6, 'Q', 8), (n6, 'Q', 8), (n6, 'H', 2)):
+            size = count * width
+            if offset + size > len(mapped):
+                raise ValueError("truncated file")
+            sections.append(view[offset:offset + size].cast(typecode))
+            offset += _pad8(size)
+        countries = json.loads(bytes(view[offset:offset + blob_size]))
+        return cls(*sections, countries=countries, mapped=mapped)
+
+    def lookup(self, ip: str) -> Optional[str]:
+        """Country for an address, or None if it is not covered"""
+        self.lookups += 1
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            self.misses += 1
+            return None
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            starts, ends, cids, key = self.v4_starts, self.v4_ends, self.v4_countries, int(address)
+        else:
+            starts, ends, cids, key = self.v6_starts, self.v6_ends, self.v6_countries, int(address) >> 64
+        i = bisect_right(starts, key) - 1
+        if i < 0 or key > ends[i]:
+            self.misses += 1
+            return None
+        return self.countries[cids[i]]
+
+    @staticmethod
+    def address_key(ip: str) -> Optional[Tuple[bool, int]]:
+        """(is_ipv6, search key) for an address, as used by ``lookup_many``"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if address.version == 4:
+            return False, int(address)
+        return True, int(address) >> 64
+
+    def lookup_many(self, keys: Sequence[int], is_v6: Sequence[int]):
+        """
+        Resolve many addresses at once. ``keys``/``is_v6`` are parallel
+        sequences from ``address_key`` (e.g. array('Q') and array('b')).
+        Returns one country index per address (into ``countries``, -1 if
+        not covered): a NumPy array via vectorized searchsorted when NumPy
+        is installed, else an array('i') filled by bisect.
+        """
+        if np is None:
+            result = array('i', bytes(4 * len(keys)))
+            for i, (key, v6) in enumerate(zip(keys, is_v6)):
+                starts, ends, cids = ((self.v6_starts, self.v6_ends, self.v6_countries) if v6
+                                      else (self.v4_starts, self.v4_ends, self.v4_countries))
+                j = bisect_right(starts, key) - 1
+                result[i] = cids[j] if j >= 0 and key <= ends[j] else -1
+            return result
+
+        keys = np.frombuffer(keys, dtype=np.uint64) if not isinstance(keys, np.ndarray) else keys
+        v6_mask = np.frombuffer(is_v6, dtype=np.int8).astype(bool) if not isinstance(is_v6, np.ndarray) else is_v6
+        result = np.full(len(keys), -1, dtype=np.int32)
+        for mask, starts, ends, cids, dtype in (
+            (~v6_mask, self.v4_starts, self.v4_ends, self.v4_countries, np.uint32),
+            (v6_mask, self.v6_starts, self.v6_ends, self.v6_countries, np.uint64),
+        ):
+            if not len(starts) or not mask.any():
+                continue
+            starts = np.frombuffer(starts, dtype=dtype)
+            ends = np.frombuffer(ends, dtype=dtype)
+            cids = np.frombuffer(cids, dtype=np.uint16)
+            selected = keys[mask]
+            idx = np.searchsorted(starts, selected, side='right') - 1
+            safe = np.maximum(idx, 0)
+            hit = (idx >= 0) & (selected <= ends[safe])
+            result[mask] = np.where(hit, cids[safe].astype(np.int32), -1)
+        return result
+
+    def get_stats(self) -> Dict:
+        """Get table size and lookup counters"""
+        return {
+            'source': self.source,
+            'ipv4_ranges': len(self.v4_starts),
+            'ipv6_ranges': len(self.v6_starts),
+            'countries': len(self.countries),
+            'mmapped': self._mapped is not None,
+            'load_ms': round(self.load_ms, 2),
+            'lookups': self.lookups,
+            'misses': self.misses
+        }
@@ -7,8 +7,18 @@ from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 import asyncio
+import base64
 import functools
+import time
+from collections import Counter
 from functools import wraps
+from analytics import WindowedCounter, WindowedDistinct
+from logstore import SegmentedLog, TIMESTAMP_FORMAT
+from sketches import HyperLogLog
+from config import (
+    COMMAND_LOG_DIR, COMMAND_LOG_SEGMENT_BYTES,
+    COMMAND_LOG_SEGMENT_AGE, COMMAND_LOG_RETENTION_DAYS
+)
 
 # Configure logging
 logging.basicConfig(
@@ -25,56 +35,355 @@ logger = logging.getLogger('ChannelBot')
 # Remove circular import
 # from bot import test_command
 
-class CommandLogger:
+class LogWriter:
+    """
+    Background writer for command/callback log entries.
+
+    Handlers only put entries on a bounded in-memory queue
+    (``put_nowait``); a single task drains it and hands each batch to
+    ``sink`` (e.g. ``SegmentedLog.append_many``) in a thread, off the event
+    loop. When the queue is
+    full the overflow policy decides what is lost: ``drop_oldest`` (default)
+    or ``drop_newest``. ``on_write``, if given, is called on the loop with
+    every batch once it is stored. ``close()`` writes whatever is still
+    queued.
+    """
+
+    def __init__(self, sink, on_write=None, maxsize: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, overflow: str = 'drop_oldest'):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.sink = sink
+        self.on_write = on_write
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def submit(self, entry: Dict[str, Any]):
+        """Queue an entry for writing; never blocks"""
+        try:
+            self.queue.put_nowait(entry)
+            return
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow == 'drop_newest':
+                return
+        # drop_oldest: make room for the new entry
+        try:
+            self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        self.queue.put_nowait(entry)
+
+    def _take_batch(self, first=None) -> list:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _write(self, batch: list):
+        try:
+            await asyncio.to_thread(self.sink, batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Error writing {len(batch)} log entries: {e}")
+            return
+        self.written += len(batch)
+        self.batches += 1
+        if self.on_write is not None:
+            self.on_write(batch)
+
+    async def run(self):
+        """Drain the queue in batches until cancelled"""
+        while True:
+            first = await self.queue.get()
+            await self._write(self._take_batch(first))
+            # Let entries accumulate so the next write is a batch
+            await asyncio.sleep(self.flush_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stop the writer and flush everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self.queue.empty():
+            await self._write(self._take_batch())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failed': self.failed
+        }
+
+class UsageStats:
+    """
+    Running command/callback usage aggregates.
+
+    Counts per command and callback since ``since``, the same per minute,
+    hour and day, and approximate distinct users (HyperLogLog) for each of
+    those windows. Updated as entries are logged, so reading them costs
+    O(buckets) instead of a scan of the log. ``state``/``from_state``
+    snapshot them, so a restart only replays entries logged after
+    ``through``.
+    """
+
     def __init__(self):
-        self.log_file = "command_logs.json"
-        self.logs: Dict[str, list] = self._load_logs()
+        self.commands = WindowedCounter()
+        self.callbacks = WindowedCounter()
+        self.users = WindowedDistinct()
+        self.all_users = HyperLogLog()
+        self.command_totals: Counter = Counter()
+        self.callback_totals: Counter = Counter()
+        self.since: Optional[str] = None    # timestamp of the first entry counted
+        self.through: Optional[str] = None  # timestamp of the last entry counted
+        self._through_count = 0             # entries counted with that timestamp
+
+    def record(self, entry: Dict[str, Any]):
+        timestamp = entry.get("timestamp")
+        try:
+            now = datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+        except (TypeError, ValueError):
+            now = time.time()
+        else:
+            if self.since is None:
+                self.since = timestamp
+            if timestamp == self.through:
+                self._through_count += 1
+            elif self.through is None or timestamp > self.through:
+                self.through = timestamp
+                self._through_count = 1
+        if entry.get("type") == "command":
+            key = entry.get("command", "unknown")
+            self.command_totals[key] += 1
+            self.commands.add(key, now=now)
+        else:
+            key = entry.get("callback_data", "unknown")
+            self.callback_totals[key] += 1
+            self.callbacks.add(key, now=now)
+        user = str(entry.get("user_id"))
+        self.all_users.add(user)
+        self.users.add(user, now=now)
+
+    def record_many(self, entries):
+        for entry in entries:
+            self.record(entry)
+
+    def replay(self, entries):
+        """Record entries logged after the snapshot, skipping ones it already counted"""
+        through, skip = self.through, self._through_count
+        for entry in entries:
+            timestamp = entry.get("timestamp", "")
+            if through is not None:
+                if timestamp < through:
+                    continue
+                # The log keeps order, so the first entries of the snapshot's
+                # last second are the ones it already counted
+                if timestamp == through and skip > 0:
+                    skip -= 1
+                    continue
+            self.record(entry)
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "since": self.since,
+            "through": self.through,
+            "through_count": self._through_count,
+            "command_totals": dict(self.command_totals),
+            "callback_totals": dict(self.callback_totals),
+            "all_users": base64.b64encode(self.all_users.to_bytes()).decode(),
+            "commands": self.commands.state(),
+            "callbacks": self.callbacks.state(),
+            "users": self.users.state()
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'UsageStats':
+        usage = cls()
+        usage.since = state["since"]
+        usage.through = state["through"]
+        usage._through_count = state["through_count"]
+        usage.command_totals.update(state["command_totals"])
+        usage.callback_totals.update(state["callback_totals"])
+        usage.all_users = HyperLogLog.from_bytes(base64.b64decode(state["all_users"]))
+        usage.commands.restore(state["commands"])
+        usage.callbacks.restore(state["callbacks"])
+        usage.users.restore(state["users"])
+        return usage
+
+    def window(self, resolution: str = 'hour', last: int = 1) -> Dict[str, Any]:
+        """Counts and distinct users over the last ``last`` buckets of a resolution"""
+        commands = self.commands.totals(resolution, last)
+        callbacks = self.callbacks.totals(resolution, last)
+        return {
+            "total_commands": sum(commands.values()),
+            "total_callbacks": sum(callbacks.values()),
+            "unique_users": self.users.count(resolution, last),
+            "command_frequency": commands,
+            "callback_frequency": callbacks
+        }
 
-    def _load_logs(self) -> Dict[str, list]:
-        """Load existing logs from file"""
+class CommandLogger:
+    """
+    Command and callback usage log.
+
+    Entries are queued on a LogWriter and stored in one SegmentedLog
+    (``type`` is ``command`` or ``callback``); ``entries`` streams them
+    back by time range. ``usage`` aggregates every stored entry; it is
+    snapshotted on shutdown (and hourly) and on start restored from the
+    snapshot plus the entries logged after it. The first start imports the
+    old JSON log files.
+    """
+
+    LEGACY_FILES = ('command_logs.json', 'callback_logs.json',
+                    'command_logs.jsonl', 'callback_logs.jsonl')
+
+    def __init__(self, store: SegmentedLog):
+        self.store = store
+        self.usage = UsageStats()
+        self.writer = LogWriter(store.append_many, on_write=lambda batch: self.usage.record_many(batch))
+        self._opening: Optional[asyncio.Task] = None
+        self._restored = False  # usage reflects the saved snapshot and the log
+        self.usage_file = os.path.join(store.directory, 'usage.json')
+
+    def open(self):
+        """Prepare the log and start the background writer (in the background)"""
+        self._opening = asyncio.create_task(self._open())
+
+    def _load(self) -> UsageStats:
+        self.store.open()
+        if self.store.is_empty():
+            self._import_legacy()
         try:
-            if os.path.exists(self.log_file):
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            with open(self.usage_file, 'r', encoding='utf-8') as f:
+                usage = UsageStats.from_state(json.load(f))
+        except FileNotFoundError:
+            usage = UsageStats()
         except Exception as e:
-            logger.error(f"Error loading logs: {e}")
-        return {"commands": [], "callbacks": []}
+            # Counts restart from what the log still retains
+            logger.error(f"Error loading {self.usage_file}: {e}")
+            usage = UsageStats()
+        since = datetime.strptime(usage.through, TIMESTAMP_FORMAT) if usage.through else None
+        usage.replay(self.store.read(since))
+        return usage
 
-    def _save_logs(self):
-        """Save logs to file"""
+    def _write_usage(self, state: Dict[str, Any]):
+        tmp_file = f"{self.usage_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_file, self.usage_file)
+
+    async def snapshot_usage(self):
+        """Persist the aggregates (serialized on the loop, written in a thread)"""
+        if self._opening is None:
+            return
+        # Never overwrite the snapshot with aggregates that were not restored from it
+        await self._opening
+        if not self._restored:
+            return
+        await asyncio.to_thread(self._write_usage, self.usage.state())
+
+    async def _open(self):
+        # New entries wait in the writer queue until the aggregates are
+        # rebuilt, so they are counted once and in order
         try:
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                json.dump(self.logs, f, indent=4, ensure_ascii=False)
+            self.usage = await asyncio.to_thread(self._load)
+            self._restored = True
         except Exception as e:
-            logger.error(f"Error saving logs: {e}")
+            logger.error(f"Error loading command log: {e}")
+        self.writer.start()
+
+    async def close(self):
+        """Write everything still queued and close the active segment"""
+        if self._opening is None:
+            # Never opened (startup failed first): nothing to flush or snapshot
+            return
+        await self._opening
+        await self.writer.close()
+        await self.snapshot_usage()
+        self.store.close()
+
+    def _import_legacy(self):
+        entries = []
+        for path in self.LEGACY_FILES:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    if path.endswith('.jsonl'):
+                        records = [json.loads(line) for line in f if line.strip()]
+                    else:
+                        data = json.load(f)
+                        records = data.get("commands", []) + data.get("callbacks", [])
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Error reading legacy log {path}: {e}")
+                continue
+            for record in records:
+                record["type"] = "command" if "command" in record else "callback"
+                entries.append(record)
+        if entries:
+            entries.sort(key=lambda entry: entry.get("timestamp", ""))
+            self.store.append_many(entries)
+            logger.info(f"Imported {len(entries)} legacy log entries")
 
     def log_command(self, user_id: int, username: Optional[str], command: str, args: Optional[str] = None):
         """Log command usage"""
         log_entry = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "type": "command",
             "user_id": user_id,
             "username": username,
             "command": command,
             "args": args
         }
-        self.logs["commands"].append(log_entry)
-        self._save_logs()
+        self.writer.submit(log_entry)
         logger.info(f"Command used: {command} by user {user_id} ({username})")
 
     def log_callback(self, user_id: int, username: Optional[str], callback_data: str):
         """Log callback query usage"""
         log_entry = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "type": "callback",
             "user_id": user_id,
             "username": username,
             "callback_data": callback_data
         }
-        self.logs["callbacks"].append(log_entry)
-        self._save_logs()
+        self.writer.submit(log_entry)
         logger.info(f"Callback used: {callback_data} by user {user_id} ({username})")
 
+    def entries(self, kind: Optional[str] = None, since: Optional[datetime] = None,
+                until: Optional[datetime] = None):
+        """Stream logged entries (optionally one type) oldest first; blocking I/O"""
+        for entry in self.store.read(since, until):
+            if kind is None or entry.get("type") == kind:
+                yield entry
+
 # Initialize command logger
-cmd_logger = CommandLogger()
+cmd_logger = CommandLogger(SegmentedLog(
+    COMMAND_LOG_DIR,
+    max_bytes=COMMAND_LOG_SEGMENT_BYTES,
+    max_age=COMMAND_LOG_SEGMENT_AGE,
+    retention_days=COMMAND_LOG_RETENTION_DAYS
+))
 
 def log_command(func):
     @wraps(func)
@@ -86,26 +395,7 @@ def log_command(func):
             command = message.command[0] if message.command else "unknown"
             
             # Log command usage
-            logger.info(f"Command used: {command} by user {user_id} (@{username})")
-            
-            # Log to JSON file
-            try:
-                with open('command_logs.json', 'r') as f:
-                    logs = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                logs = {"commands": []}
-            
-            # Add new log entry
-            logs["commands"].append({
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "command": command,
-                "user_id": str(user_id),
-                "username": username
-            })
-            
-            # Save updated logs
-            with open('command_logs.json', 'w') as f:
-                json.dump(logs, f, indent=4)
+            cmd_logger.log_command(user_id, username, command)
             
             # Execute the command
             return await func(client, message, *args, **kwargs)
@@ -127,26 +417,7 @@ def log_callback(func):
             data = callback_query.data if callback_query.data else "unknown"
             
             # Log callback usage
-            logger.info(f"Callback used: {data} by user {user_id} (@{username})")
-            
-            # Log to JSON file
-            try:
-                with open('callback_logs.json', 'r') as f:
-                    logs = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                logs = {"callbacks": []}
-            
-            # Add new log entry
-            logs["callbacks"].append({
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "callback_data": data,
-                "user_id": str(user_id),
-                "username": username
-            })
-            
-            # Save updated logs
-            with open('callback_logs.json', 'w') as f:
-                json.dump(logs, f, indent=4)
+            cmd_logger.log_callback(user_id, username, data)
             
             # Execute the callback
             return await func(client, callback_query, *args, **kwargs)
@@ -163,30 +434,15 @@ def get_command_stats() -> Dict[str, Any]:
     Get command usage statistics
     Returns a dictionary with command usage data
     """
-    stats = {
-        "total_commands": len(cmd_logger.logs["commands"]),
-        "total_callbacks": len(cmd_logger.logs["callbacks"]),
-        "unique_users": set(),
-        "command_frequency": {},
-        "callback_frequency": {}
+    usage = cmd_logger.usage
+    return {
+        "since": usage.since,
+        "total_commands": sum(usage.command_totals.values()),
+        "total_callbacks": sum(usage.callback_totals.values()),
+        "unique_users": usage.all_users.count(),
+        "command_frequency": dict(usage.command_totals),
+        "callback_frequency": dict(usage.callback_totals)
     }
-    
-    # Process commands
-    for cmd in cmd_logger.logs["commands"]:
-        stats["unique_users"].add(cmd["user_id"])
-        command = cmd["command"]
-        stats["command_frequency"][command] = stats["command_frequency"].get(command, 0) + 1
-    
-    # Process callbacks
-    for cb in cmd_logger.logs["callbacks"]:
-        stats["unique_users"].add(cb["user_id"])
-        callback = cb["callback_data"]
-        stats["callback_frequency"][callback] = stats["callback_frequency"].get(callback, 0) + 1
-    
-    # Convert set to length for JSON serialization
-    stats["unique_users"] = len(stats["unique_users"])
-    
-    return stats
 
 async def log_periodic_stats():
     """
@@ -196,12 +452,16 @@ async def log_periodic_stats():
     while True:
         try:
             stats = get_command_stats()
-            logger.info("Command Usage Statistics:")
+            last_hour = cmd_logger.usage.window('minute', 60)
+            logger.info(f"Command Usage Statistics (since {stats['since']}):")
             logger.info(f"Total Commands: {stats['total_commands']}")
             logger.info(f"Total Callbacks: {stats['total_callbacks']}")
             logger.info(f"Unique Users: {stats['unique_users']}")
             logger.info(f"Command Frequency: {stats['command_frequency']}")
             logger.info(f"Callback Frequency: {stats['callback_frequency']}")
+            logger.info(f"Last Hour: {last_hour['total_commands']} commands, "
+                        f"{last_hour['total_callbacks']} callbacks, ~{last_hour['unique_users']} users")
+            await cmd_logger.snapshot_usage()
         except Exception as e:
             logger.error(f"Error logging periodic stats: {e}")
         
@@ -212,6 +472,7 @@ def setup_command_handlers(app: Client):
     Set up command handlers with logging
     This should be called when initializing the bot
     """
-    # Start periodic stats logging
+    # Start the command log writer and periodic stats logging
+    cmd_logger.open()
     asyncio.create_task(log_periodic_stats())
     logger.info("Command logging system initialized") 
\ No newline at end of file
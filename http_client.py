@@ -0,0 +1,92 @@
+import logging
+from typing import Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger('HTTPClient')
+
+
+class HTTPSessionManager:
+    """
+    One pooled aiohttp ClientSession shared by every outbound HTTP call.
+
+    The connector keeps connections alive between requests, caches DNS
+    answers and caps connections per host; all requests get explicit
+    timeouts. Trace hooks count how often a pooled connection was reused
+    instead of opening a new one.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10, dns_ttl: int = 300,
+                 keepalive_timeout: float = 30, total_timeout: float = 10, connect_timeout: float = 5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.stats = {
+            'requests': 0,
+            'request_errors': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def on_signal(session, context, params):
+                self.stats[name] += 1
+            return on_signal
+
+        trace.on_request_start.append(counter('requests'))
+        trace.on_request_exception.append(counter('request_errors'))
+        trace.on_connection_create_end.append(counter('connections_created'))
+        trace.on_connection_reuseconn.append(counter('connections_reused'))
+        trace.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace
+
+    async def start(self):
+        """Create the shared session (must run inside the event loop)"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[self._trace_config()]
+        )
+        logger.info("HTTP session pool started")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session, starting it on first use"""
+        if self.session is None or self.session.closed:
+            await self.start()
+        return self.session
+
+    async def close(self):
+        """Close the session and all pooled connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("HTTP session pool closed")
+        self.session = None
+
+    def get_stats(self) -> Dict:
+        """Get request and connection pool statistics"""
+        stats = dict(self.stats)
+        opened = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_ratio'] = round(stats['connections_reused'] / opened, 4) if opened else 0.0
+        connector = self.session.connector if self.session is not None else None
+        if connector is not None:
+            stats['idle_connections'] = sum(len(conns) for conns in connector._conns.values())
+            stats['active_connections'] = len(connector._acquired)
+        return stats
@@ -0,0 +1,148 @@
+import heapq
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Set
+
+_MAGIC = b'IDSET1' + (b'LE' if sys.byteorder == 'little' else b'BE')
+_HEADER = struct.Struct('<8sQ')  # magic, count
+
+
+class IdSet:
+    """
+    Compact set of 64-bit ids (Telegram user ids).
+
+    Members live in a sorted ``array('q')`` at 8 bytes each, searched with
+    bisect (O(log n)). Recent changes go to two small delta sets and are
+    merged into the array once they outgrow ``merge_threshold`` (or 1/32 of
+    the array, whichever is larger), so merges stay amortized. The array
+    can be saved as a flat binary file and mapped back with ``load``
+    without parsing.
+    """
+
+    def __init__(self, base=None, merge_threshold: int = 4096):
+        # Sorted, unique; an array or a read-only memoryview over a mapping
+        self._base = base if base is not None else array('q')
+        self._added: Set[int] = set()    # members not in the base
+        self._removed: Set[int] = set()  # base entries that are no longer members
+        self._mapped = None
+        self.merge_threshold = merge_threshold
+        self.merges = 0
+
+    @classmethod
+    def from_sorted(cls, ids: Iterable[int]) -> 'IdSet':
+        """Build from ids already sorted ascending without duplicates"""
+        return cls(array('q', ids))
+
+    @classmethod
+    def from_iterable(cls, ids: Iterable[int]) -> 'IdSet':
+        values = array('q', ids)
+        return cls(array('q', sorted(set(values))))
+
+    def _in_base(self, user_id: int) -> bool:
+        base = self._base
+        i = bisect_left(base, user_id)
+        return i < len(base) and base[i] == user_id
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._added:
+            return True
+        if user_id in self._removed:
+            return False
+        return self._in_base(user_id)
+
+    def add(self, user_id: int):
+        if user_id in self._removed:
+            self._removed.discard(user_id)
+        elif user_id not in self._added and not self._in_base(user_id):
+            self._added.add(user_id)
+            self._maybe_merge()
+
+    def discard(self, user_id: int):
+        if user_id in self._added:
+            self._added.discard(user_id)
+        elif user_id not in self._removed and self._in_base(user_id):
+            self._removed.add(user_id)
+            self._maybe_merge()
+
+    def _maybe_merge(self):
+        if len(self._added) + len(self._removed) > max(self.merge_threshold, len(self._base) >> 5):
+            self.merge()
+
+    def merge(self):
+        """Fold the delta sets into the sorted array"""
+        if not self._added and not self._removed:
+            return
+        self._base = array('q', iter(self))
+        self._added.clear()
+        self._removed.clear()
+        self._mapped = None  # unmapped once the last view is gone
+        self.merges += 1
+
+    def snapshot(self) -> 'IdSet':
+        """
+        Point-in-time copy for iterating off the event loop. Shares the
+        sorted array (merges replace it, never modify it), so this is O(delta).
+        """
+        copy = IdSet(self._base, self.merge_threshold)
+        copy._added = set(self._added)
+        copy._removed = set(self._removed)
+        copy._mapped = self._mapped
+        return copy
+
+    def __iter__(self) -> Iterator[int]:
+        """Members in ascending order"""
+        removed = self._removed
+        base = self._base if not removed else (v for v in self._base if v not in removed)
+        if not self._added:
+            return iter(base)
+        return heapq.merge(base, sorted(self._added))
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._removed) + len(self._added)
+
+    def to_bytes(self) -> bytes:
+        """Binary form: header + native-order sorted int64 array"""
+        self.merge()
+        base = self._base
+        return _HEADER.pack(_MAGIC, len(base)) + (base.tobytes() if isinstance(base, array) else bytes(base))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IdSet':
+        """Map a saved set; lookups read the file pages in place"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("empty file")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(mapped) if len(mapped) >= _HEADER.size else (None, 0)
+        if magic != _MAGIC or len(mapped) != _HEADER.size + 8 * count:
+            mapped.close()
+            raise ValueError("not an IdSet file or wrong byte order")
+        ids = cls(memoryview(mapped)[_HEADER.size:].cast('q'))
+        ids._mapped = mapped
+        return ids
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size (array storage + delta sets)"""
+        base = 0 if self._mapped is not None else 8 * len(self._base)
+        return base + sys.getsizeof(self._added) + sys.getsizeof(self._removed) + \
+            28 * (len(self._added) + len(self._removed))
+
+    def get_stats(self) -> Dict:
+        return {
+            'size': len(self),
+            'base': len(self._base),
+            'delta': len(self._added) + len(self._removed),
+            'mmapped': self._mapped is not None,
+            'memory_bytes': self.memory_bytes(),
+            'merges': self.merges
+        }
@@ -1,8 +1,17 @@
-import json
-import aiohttp
+import asyncio
+import ipaddress
 import logging
-from typing import Dict, Set, Optional, Tuple
+import time
+from typing import Dict, Optional, Tuple
 from datetime import datetime
+from analytics import LatencyWindow, WindowedCounter
+from audit import VECTORIZED, LastSeenIPs, diff_countries
+from cache import TTLCache
+from concurrency import KeyedLock, SingleFlight, TokenBucket
+from geoip import GeoIPDatabase
+from http_client import HTTPSessionManager
+from iprange import IPRangeSet
+from userstore import FileUserSet, MongoUserSet
 
 # Configure logging
 logging.basicConfig(
@@ -16,64 +25,149 @@ logging.basicConfig(
 
 logger = logging.getLogger('IPChecker')
 
+# Lookup priorities for the ip-api.com wait queue (lower is served first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class GeoLookupUnavailable(Exception):
+    """The country could not be determined right now (rate limited or provider error)"""
+
+
 class IPChecker:
-    def __init__(self):
+    def __init__(self, http: Optional[HTTPSessionManager] = None, geoip: Optional[GeoIPDatabase] = None,
+                 geo_cache_size: int = 50000, geo_cache_ttl: int = 21600,
+                 user_cache_size: int = 50000, user_cache_ttl: int = 86400,
+                 api_url: str = 'http://ip-api.com/json/', api_rate_limit: int = 45,
+                 api_queue_size: int = 100, api_max_wait: float = 10,
+                 banned_collection=None, verified_collection=None):
+        # Shared, pooled HTTP session (own pool if none is injected)
+        self.http = http or HTTPSessionManager()
+        # ip-api.com free tier: 45 requests per minute, enforced client-side
+        self.api_url = api_url
+        self.api_max_wait = api_max_wait
+        self.limiter = TokenBucket(limit=api_rate_limit, window=60, max_waiters=api_queue_size)
+        # Offline range database; primary source for country checks when loaded
+        self.geoip = geoip
+        self.offline_checks = 0
+        self.api_checks = 0
+        self.deferred_checks = 0
+        # Concurrent lookups of one IP share a single request; checks of one
+        # user run one at a time
+        self.lookups = SingleFlight()
+        self.user_locks = KeyedLock()
         self.banned_users_file = 'userBAN.json'
         self.verified_users_file = 'userIP.json'
-        self.banned_users: Set[int] = self._load_banned_users()
-        self.verified_users: Set[int] = self._load_verified_users()
-        self.user_cache: Dict[int, Dict] = {}  # Cache user checks to reduce API calls
+        # Banned/verified users: Mongo-backed with write-behind when the
+        # collections are given, else compact binary files. Either way the
+        # binary .ids file is what boot maps (a cache of the collection for
+        # Mongo). The old JSON files are imported once. Call load_user_lists()
+        # before use.
+        if banned_collection is not None:
+            self.banned_users = MongoUserSet(banned_collection, legacy_file=self.banned_users_file,
+                                             legacy_key='userban', cache_path='userBAN.ids')
+        else:
+            self.banned_users = FileUserSet('userBAN.ids', self.banned_users_file, 'userban')
+        if verified_collection is not None:
+            self.verified_users = MongoUserSet(verified_collection, legacy_file=self.verified_users_file,
+                                               legacy_key='verified_users', cache_path='userIP.ids')
+        else:
+            self.verified_users = FileUserSet('userIP.ids', self.verified_users_file, 'verified_users')
+        # Banned networks (VPN/datacenter ranges), checked before any geo lookup
+        self.banned_ranges = IPRangeSet('banned_ranges.txt')
+        self._ranges_lock = asyncio.Lock()  # one range change (in a worker thread) at a time
+        self.range_blocks = 0
+        # Last IP per user, re-resolved in bulk by reaudit()
+        self.last_seen = LastSeenIPs('last_seen.bin')
+        self.last_audit: Optional[Dict] = None
+        # Cache user checks to reduce API calls. Per-country and pass/fail
+        # counts over the cached verdicts are kept up to date as entries
+        # come and go; stats only have to drop expired verdicts first.
+        self.country_counts: Dict[str, int] = {}
+        self.verdict_counts = {'passed': 0, 'failed': 0}
+        self.user_cache = TTLCache(maxsize=user_cache_size, ttl=user_cache_ttl,
+                                   on_evict=lambda user_id, entry: self._count_verdict(entry, -1))
+        # Checks over the last hour/day and lookup latencies by source
+        self.check_windows = WindowedCounter({'minute': (60, 60), 'hour': (3600, 24)})
+        self.country_windows = WindowedCounter({'minute': (60, 60), 'hour': (3600, 24)})
+        self.latency = {'offline': LatencyWindow(), 'api': LatencyWindow()}
+        # Geolocation keyed by IP, shared by check_ip and get_ip_info
+        # (many users share one address behind CGNAT)
+        self.geo_cache = TTLCache(maxsize=geo_cache_size, ttl=geo_cache_ttl)
         
-    def _load_banned_users(self) -> Set[int]:
-        """Load banned users from JSON file"""
-        try:
-            with open(self.banned_users_file, 'r') as f:
-                data = json.load(f)
-                return set(data.get('userban', []))
-        except (FileNotFoundError, json.JSONDecodeError):
-            return set()
-    
-    def _load_verified_users(self) -> Set[int]:
-        """Load verified users from JSON file"""
-        try:
-            with open(self.verified_users_file, 'r') as f:
-                data = json.load(f)
-                return set(data.get('verified_users', []))
-        except (FileNotFoundError, json.JSONDecodeError):
-            return set()
-    
-    def _save_banned_users(self):
-        """Save banned users to JSON file"""
-        with open(self.banned_users_file, 'w') as f:
-            json.dump({'userban': list(self.banned_users)}, f, indent=4)
-    
-    def _save_verified_users(self):
-        """Save verified users to JSON file"""
-        with open(self.verified_users_file, 'w') as f:
-            json.dump({'verified_users': list(self.verified_users)}, f, indent=4)
-    
-    async def get_ip_info(self, ip: str) -> Dict:
+    async def load_user_lists(self):
+        """Load the banned and verified user lists and banned ranges"""
+        await self.banned_users.load()
+        await self.verified_users.load()
+        await asyncio.to_thread(self.banned_ranges.load)
+        await asyncio.to_thread(self.last_seen.load)
+        logger.info(f"Loaded {len(self.banned_users)} banned and {len(self.verified_users)} verified users, "
+                    f"{len(self.banned_ranges)} banned ranges")
+    
+    async def flush_user_lists(self):
+        """Write pending banned/verified changes and last seen IPs"""
+        await self.banned_users.flush()
+        await self.verified_users.flush()
+        await self.last_seen.snapshot()
+    
+    async def run_user_list_flusher(self, interval: int = 30):
+        """Periodically write pending banned/verified changes"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_user_lists()
+            except Exception as e:
+                logger.error(f"Error flushing user lists: {e}")
+    
+    async def _lookup(self, ip: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict]:
+        """
+        Resolve an IP through the geo cache, querying ip-api.com on a miss.
+        Returns None if the provider had no answer; failures are not cached.
+        """
+        info = self.geo_cache.get(ip)
+        if info is not None:
+            return info
+        return await self.lookups.do(ip, self._fetch, ip, priority)
+    
+    async def _fetch(self, ip: str, priority: int) -> Optional[Dict]:
+        """Query ip-api.com within the rate budget and cache a successful answer"""
+        if not await self.limiter.acquire(priority, self.api_max_wait):
+            raise GeoLookupUnavailable("ip-api.com request budget exhausted")
+        session = await self.http.get_session()
+        async with session.get(f'{self.api_url}{ip}') as response:
+            # X-Rl: requests left in the current window, X-Ttl: seconds until it resets
+            if response.status == 429 or response.headers.get('X-Rl') == '0':
+                self.limiter.pause(int(response.headers.get('X-Ttl', 60)))
+            if response.status == 429:
+                raise GeoLookupUnavailable("ip-api.com rate limit reached")
+            data = await response.json()
+        if data.get('status') != 'success':
+            return None
+        info = {
+            'country': data.get('country', 'Unknown'),
+            'region': data.get('regionName', 'Unknown'),
+            'city': data.get('city', 'Unknown'),
+            'isp': data.get('isp', 'Unknown'),
+            'timezone': data.get('timezone', 'Unknown'),
+            'ip': ip
+        }
+        self.geo_cache.set(ip, info)
+        return info
+    
+    async def get_ip_info(self, ip: str, priority: int = PRIORITY_INTERACTIVE) -> Dict:
         """
         Get detailed IP information
         Returns full IP info dictionary
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f'http://ip-api.com/json/{ip}') as response:
-                    data = await response.json()
-                    if data.get('status') == 'success':
-                        return {
-                            'country': data.get('country', 'Unknown'),
-                            'region': data.get('regionName', 'Unknown'),
-                            'city': data.get('city', 'Unknown'),
-                            'isp': data.get('isp', 'Unknown'),
-                            'timezone': data.get('timezone', 'Unknown'),
-                            'ip': ip
-                        }
+            info = await self._lookup(ip, priority)
+            if info is not None:
+                return dict(info)
         except Exception as e:
             logger.error(f"Error getting IP info for {ip}: {str(e)}")
+        country = self.geoip.lookup(ip) if self.geoip is not None else None
         return {
-            'country': 'Unknown',
+            'country': country or 'Unknown',
             'region': 'Unknown',
             'city': 'Unknown',
             'isp': 'Unknown',
@@ -81,22 +175,42 @@ class IPChecker:
             'ip': ip
         }
     
-    async def check_ip(self, ip: str) -> Tuple[bool, str]:
+    @staticmethod
+    def _is_indian(country: str) -> bool:
+        # The offline database may carry ISO codes instead of names
+        return country.lower() in ('india', 'in')
+    
+    async def check_ip(self, ip: str, priority: int = PRIORITY_INTERACTIVE) -> Tuple[bool, str]:
         """
-        Check if IP is from India using ip-api.com
+        Check if IP is from India using the offline database, falling back
+        to ip-api.com for addresses it does not cover
         Returns: (is_indian: bool, country: str)
+        Raises GeoLookupUnavailable if the API cannot be asked right now
         """
+        if self.geoip is not None:
+            started = time.perf_counter()
+            country = self.geoip.lookup(ip)
+            self.latency['offline'].record((time.perf_counter() - started) * 1000)
+            if country is not None:
+                self.offline_checks += 1
+                return self._is_indian(country), country
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f'http://ip-api.com/json/{ip}') as response:
-                    data = await response.json()
-                    if data.get('status') == 'success':
-                        country = data.get('country', 'Unknown')
-                        is_indian = country.lower() == 'india'
-                        return is_indian, country
+            self.api_checks += 1
+            started = time.perf_counter()
+            info = await self._lookup(ip, priority)
+            self.latency['api'].record((time.perf_counter() - started) * 1000)
+            if info is not None:
+                country = info['country']
+                is_indian = self._is_indian(country)
+                return is_indian, country
+        except GeoLookupUnavailable:
+            raise
         except Exception as e:
+            # Transport errors and timeouts say nothing about the user's country
             logger.error(f"Error checking IP {ip}: {str(e)}")
-        return False, 'Unknown'
+            raise GeoLookupUnavailable(str(e)) from e
+        # ip-api answered 'fail' (e.g. 0.0.0.0 when the IP could not be read)
+        raise GeoLookupUnavailable(f"ip-api.com could not locate {ip}")
     
     def is_user_banned(self, user_id: int) -> bool:
         """Check if user is banned"""
@@ -109,53 +223,261 @@ class IPChecker:
     def add_verified_user(self, user_id: int):
         """Add user to verified users"""
         self.verified_users.add(user_id)
-        self._save_verified_users()
+    
+    def ban_user(self, user_id: int):
+        """Add user to banned users"""
+        self.banned_users.add(user_id)
+    
+    def unban_user(self, user_id: int) -> bool:
+        """Remove user from banned users; returns False if they were not banned"""
+        return self.banned_users.discard(user_id)
+    
+    def is_ip_banned(self, ip: str) -> bool:
+        """Check if an IP falls in a banned range (placeholders like 0.0.0.0 never do)"""
+        try:
+            if ipaddress.ip_address(ip).is_unspecified:
+                return False
+        except ValueError:
+            return False
+        return ip in self.banned_ranges
+    
+    async def ban_ranges(self, lines) -> Tuple[int, list]:
+        """Ban networks given one CIDR per line; returns (added, invalid entries)"""
+        async with self._ranges_lock:
+            added, invalid = await asyncio.to_thread(self.banned_ranges.add_many, lines)
+            if added:
+                await asyncio.to_thread(self.banned_ranges.save)
+        return added, invalid
+    
+    async def unban_range(self, cidr: str) -> bool:
+        """Remove a banned network; raises ValueError if it is not a valid CIDR"""
+        async with self._ranges_lock:
+            removed = await asyncio.to_thread(self.banned_ranges.remove, cidr)
+            if removed:
+                await asyncio.to_thread(self.banned_ranges.save)
+        return removed
     
     async def verify_user(self, user_id: int, ip: str) -> Tuple[bool, Optional[str]]:
         """
         Verify if user should be allowed to use the bot
         Returns: (is_allowed: bool, message: Optional[str])
         """
+        # A second concurrent check for the same user waits and then sees
+        # the first one's cached verdict or ban
+        async with self.user_locks.hold(user_id):
+            return await self._verify_user(user_id, ip)
+    
+    async def _verify_user(self, user_id: int, ip: str) -> Tuple[bool, Optional[str]]:
         # Check if user is already banned
         if self.is_user_banned(user_id):
             return False, "🚫 You are banned from using this bot."
         
+        # Banned networks need no geo lookup. Only this request is refused:
+        # the address may not be the user's own (get_user_ip can fall back
+        # to the bot host's), so it is no reason to ban the account
+        if self.is_ip_banned(ip):
+            self.range_blocks += 1
+            logger.warning(f"Refused user {user_id} from banned range (IP: {ip})")
+            return False, "🚫 Access from your network is not allowed."
+        
         # Check if we have cached result
-        if user_id in self.user_cache:
-            if self.user_cache[user_id].get('is_indian', False):
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            if cached.get('is_indian', False):
+                self._record_ip(user_id, ip)
                 return True, None
             return False, "🚫 This bot is only available for users from India."
         
-        # Check IP
-        is_indian, country = await self.check_ip(ip)
+        # Check IP; if the provider can't be asked right now, never ban on it
+        try:
+            is_indian, country = await self.check_ip(ip)
+        except GeoLookupUnavailable as e:
+            self.deferred_checks += 1
+            self.check_windows.add('deferred')
+            logger.info(f"Deferred check of user {user_id}: {e}")
+            return False, "⏳ We couldn't verify your location right now. Please try again in a minute."
         
         # Cache the result
-        self.user_cache[user_id] = {
+        entry = {
             'ip': ip,
             'country': country,
             'is_indian': is_indian,
             'checked_at': datetime.now().isoformat()
         }
+        self.user_cache.set(user_id, entry)
+        self._count_verdict(entry, 1)
+        self.check_windows.add('passed' if is_indian else 'failed')
+        self.country_windows.add(country)
         
         if not is_indian:
             # Ban user if not from India
-            self.banned_users.add(user_id)
-            self._save_banned_users()
+            self.ban_user(user_id)
             
             # Log the ban
             logger.warning(f"Banned user {user_id} from {country} (IP: {ip})")
             
             return False, f"🚫 This bot is only available for users from India.\nYour country: {country}"
         
+        self._record_ip(user_id, ip, country)
         return True, None
     
-    def get_stats(self) -> Dict:
-        """Get IP verification statistics"""
+    def _record_ip(self, user_id: int, ip: str, country: Optional[str] = None):
+        """Remember a verified user's IP for reaudit; nobody else is audited"""
+        if self.is_verified(user_id):
+            self.last_seen.record(user_id, ip, country)
+    
+    async def reaudit(self, max_changes: int = 20, api_fallback: int = 40) -> Dict:
+        """
+        Re-resolve every verified user's last seen IP against the GeoIP
+        database in one batch. Users whose country changed are reported;
+        those now outside India lose their verified status so they have to
+        verify again.
+
+        Only users with a recorded last IP are covered. IPs are recorded by
+        verify_user (/myip, /broadcast) for verified users who pass it, and
+        dropped when they lose verified status; web app verification runs in the
+        user's browser and never tells the bot an address, and get_user_ip
+        falls back to the bot host's own address. So most verified users are
+        not audited; ``verified`` vs ``audited`` in the report shows the gap.
+
+        Up to ``api_fallback`` addresses the database does not cover are
+        looked up on ip-api.com at background priority, so interactive
+        checks keep first claim on the request budget. The fallback stops
+        as soon as the budget is not available.
+        """
+        if self.geoip is None:
+            raise RuntimeError("GeoIP database is not loaded")
+        started = time.perf_counter()
+        # One pass over every recorded user; off the loop on copies
+        users, keys, is_v6, baseline = await asyncio.to_thread(
+            self.last_seen.copy().columns, self.verified_users.snapshot()
+        )
+        geo_ids = {name: i for i, name in enumerate(self.geoip.countries)}
+        translate = [geo_ids.get(name, -1) for name in self.last_seen.country_names]
+        
+        resolve_started = time.perf_counter()
+        current, changed = await asyncio.to_thread(diff_countries, self.geoip, keys, is_v6, baseline, translate)
+        resolve_seconds = time.perf_counter() - resolve_started
+        
+        changes = []
+        counts = {'baselined': 0, 'queued': 0}
+        
+        def apply(user_id: int, country: str):
+            previous = self.last_seen.country_of(user_id)
+            if previous == country:
+                return
+            self.last_seen.set_country(user_id, country)
+            if previous is None:
+                # First audit of this user: nothing to diff against yet
+                counts['baselined'] += 1
+            else:
+                changes.append((user_id, previous, country))
+            if not self._is_indian(country) and self.verified_users.discard(user_id):
+                self.user_cache.pop(user_id)
+                self.last_seen.forget(user_id)
+                counts['queued'] += 1
+        
+        for i in changed:
+            apply(users[i], self.geoip.countries[int(current[i])])
+        
+        # Addresses outside the database, one at a time behind interactive checks
+        uncovered = [users[i] for i in range(len(users)) if current[i] < 0]
+        api_resolved = 0
+        for user_id in uncovered[:api_fallback]:
+            ip = self.last_seen.ip_of(user_id)
+            if ip is None:
+                continue  # lost verified status since the snapshot
+            try:
+                info = await self._lookup(ip, PRIORITY_BACKGROUND)
+            except GeoLookupUnavailable:
+                break
+            except Exception as e:
+                logger.error(f"Error re-auditing IP {ip}: {str(e)}")
+                continue
+            if info is not None:
+                api_resolved += 1
+                apply(user_id, info['country'])
+        
+        total_seconds = time.perf_counter() - started
+        self.last_audit = {
+            'verified': len(self.verified_users),
+            'audited': len(users),
+            'changed': len(changes),
+            'baselined': counts['baselined'],
+            'queued': counts['queued'],
+            'uncovered': len(uncovered),
+            'api_resolved': api_resolved,
+            'engine': 'numpy' if VECTORIZED else 'bisect',
+            'resolve_seconds': round(resolve_seconds, 4),
+            'total_seconds': round(total_seconds, 4),
+            'users_per_second': int(len(users) / resolve_seconds) if resolve_seconds else 0,
+            'changes': changes[:max_changes],
+            'finished_at': datetime.now().isoformat()
+        }
+        logger.info(f"Re-audited {len(users)} users in {total_seconds:.2f}s: "
+                    f"{len(changes)} changed, {counts['queued']} queued for re-verification, "
+                    f"{api_resolved}/{len(uncovered)} uncovered resolved via API")
+        return self.last_audit
+    
+    async def run_reaudit(self, interval: int = 86400):
+        """Periodically re-audit verified users"""
+        while True:
+            await asyncio.sleep(interval)
+            if self.geoip is None:
+                continue
+            try:
+                await self.reaudit()
+            except Exception as e:
+                logger.error(f"Error re-auditing verified users: {e}")
+    
+    def _count_verdict(self, entry: Dict, delta: int):
+        """Apply a cached verdict to (delta=1) or remove it from (delta=-1) the aggregates"""
+        country = entry['country']
+        count = self.country_counts.get(country, 0) + delta
+        if count > 0:
+            self.country_counts[country] = count
+        else:
+            self.country_counts.pop(country, None)
+        self.verdict_counts['passed' if entry['is_indian'] else 'failed'] += delta
+    
+    def _window_stats(self, resolution: str, last: int, top_k: int) -> Dict:
+        checks = self.check_windows.totals(resolution, last)
+        decided = checks['passed'] + checks['failed']
+        return {
+            'passed': checks['passed'],
+            'failed': checks['failed'],
+            'deferred': checks['deferred'],
+            'pass_ratio': round(checks['passed'] / decided, 4) if decided else 0.0,
+            'countries': dict(self.country_windows.totals(resolution, last).most_common(top_k))
+        }
+    
+    def get_stats(self, top_k: int = 10) -> Dict:
+        """Get IP verification statistics over live cached verdicts (top_k countries by users)"""
+        # Expired verdicts stay in the cache until read or evicted; drop them
+        # so they leave the aggregates
+        self.user_cache.expire()
+        cached = self.verdict_counts['passed'] + self.verdict_counts['failed']
+        top_countries = sorted(self.country_counts.items(), key=lambda item: item[1], reverse=True)[:top_k]
         return {
             'total_banned': len(self.banned_users),
             'total_checked': len(self.user_cache),
-            'countries': {
-                data['country']: len([u for u, d in self.user_cache.items() if d['country'] == data['country']])
-                for data in self.user_cache.values()
-            }
+            'countries': dict(top_countries),
+            'pass_ratio': round(self.verdict_counts['passed'] / cached, 4) if cached else 0.0,
+            'last_hour': self._window_stats('minute', 60, top_k),
+            'last_day': self._window_stats('hour', 24, top_k),
+            'latency_ms': {source: window.percentiles() for source, window in self.latency.items()},
+            'banned_store': self.banned_users.get_stats(),
+            'banned_ranges': self.banned_ranges.get_stats(),
+            'range_blocks': self.range_blocks,
+            'verified_store': self.verified_users.get_stats(),
+            'geo_cache': self.geo_cache.get_stats(),
+            'user_cache': self.user_cache.get_stats(),
+            'offline_checks': self.offline_checks,
+            'api_checks': self.api_checks,
+            'api_requests': self.lookups.calls,
+            'coalesced_lookups': self.lookups.coalesced,
+            'serialized_verifications': self.user_locks.contended,
+            'deferred_checks': self.deferred_checks,
+            'rate_limiter': self.limiter.get_stats(),
+            'geoip': self.geoip.get_stats() if self.geoip is not None else None
         } 
\ No newline at end of file
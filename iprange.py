@@ -0,0 +1,155 @@
+import ipaddress
+import logging
+import os
+import socket
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger('IPRanges')
+
+
+def parse_network(cidr: str) -> Tuple[str, int, int, int]:
+    """
+    Parse a CIDR or single address into (normalized CIDR, version, first,
+    last address as integers). Raises ValueError if invalid.
+    """
+    cidr = cidr.strip()
+    address, _, prefix = cidr.partition('/')
+    if ':' not in address:
+        # Fast path for IPv4, which is most of any bulk list
+        try:
+            start = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+        except OSError:
+            raise ValueError(f"invalid network: {cidr}")
+        length = int(prefix) if prefix.isdigit() else (32 if not prefix else -1)
+        if not 0 <= length <= 32:
+            raise ValueError(f"invalid network: {cidr}")
+        host_bits = (1 << (32 - length)) - 1
+        start &= ~host_bits
+        normalized = f"{socket.inet_ntop(socket.AF_INET, start.to_bytes(4, 'big'))}/{length}"
+        return normalized, 4, start, start | host_bits
+    network = ipaddress.ip_network(cidr, strict=False)
+    return str(network), network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def _merge(intervals: List[Tuple[int, int]]) -> Tuple[list, list]:
+    """Sort and coalesce overlapping or adjacent [start, end] intervals"""
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+class IPRangeSet:
+    """
+    Set of banned IP networks (CIDR, IPv4 and IPv6) with an interval index.
+
+    Networks are flattened into sorted, non-overlapping [start, end]
+    intervals per address family, so a check is one bisect (O(log n)) no
+    matter how many ranges are loaded. The index is rebuilt once per
+    change batch; the networks themselves are kept for listing, removal
+    and persistence to ``path`` (one CIDR per line).
+    """
+
+    def __init__(self, path: str = 'banned_ranges.txt'):
+        self.path = path
+        self.networks: Dict[str, Tuple[int, int, int]] = {}  # cidr -> (version, first, last)
+        self._v4 = (array('I'), array('I'))
+        self._v6: Tuple[list, list] = ([], [])
+        self.checks = 0
+        self.matches = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                _, invalid = self.add_many(f)
+        except FileNotFoundError:
+            return
+        if invalid:
+            logger.warning(f"Skipped {len(invalid)} invalid ranges in {self.path}")
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.writelines(f"{network}\n" for network in sorted(self.networks))
+        os.replace(tmp_path, self.path)
+
+    def add_many(self, lines: Iterable[str]) -> Tuple[int, List[str]]:
+        """
+        Add networks from lines (blank lines and # comments are skipped).
+        Returns (number added, invalid entries).
+        """
+        added, invalid = 0, []
+        for line in lines:
+            entry = line.split('#', 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                network, version, first, last = parse_network(entry)
+            except ValueError:
+                invalid.append(entry)
+                continue
+            if network not in self.networks:
+                self.networks[network] = (version, first, last)
+                added += 1
+        if added:
+            self._rebuild()
+        return added, invalid
+
+    def add(self, cidr: str) -> bool:
+        """Add one network; returns False if it was already banned"""
+        added, invalid = self.add_many([cidr])
+        if invalid:
+            raise ValueError(f"invalid network: {cidr}")
+        return added > 0
+
+    def remove(self, cidr: str) -> bool:
+        """Remove one network exactly as banned; returns False if it was not"""
+        network = parse_network(cidr)[0]
+        if network not in self.networks:
+            return False
+        del self.networks[network]
+        self._rebuild()
+        return True
+
+    def _rebuild(self):
+        v4, v6 = [], []
+        for version, first, last in self.networks.values():
+            (v4 if version == 4 else v6).append((first, last))
+        starts, ends = _merge(v4)
+        self._v4 = (array('I', starts), array('I', ends))
+        self._v6 = _merge(v6)
+
+    def __contains__(self, ip: str) -> bool:
+        self.checks += 1
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        starts, ends = self._v4 if address.version == 4 else self._v6
+        key = int(address)
+        i = bisect_right(starts, key) - 1
+        if i >= 0 and key <= ends[i]:
+            self.matches += 1
+            return True
+        return False
+
+    def __len__(self) -> int:
+        return len(self.networks)
+
+    def get_stats(self) -> Dict:
+        return {
+            'networks': len(self.networks),
+            'ipv4_intervals': len(self._v4[0]),
+            'ipv6_intervals': len(self._v6[0]),
+            'checks': self.checks,
+            'matches': self.matches
+        }
@@ -0,0 +1,1105 @@
+import asyncio
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlencode, parse_qsl, urlsplit, urlunsplit
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from sketches import HyperLogLog
+
+logger = logging.getLogger('LinkStore')
+
+TELEGRAM_HOSTS = {'t.me', 'telegram.me', 'telegram.dog'}
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so trivially different spellings of the same target
+    compare equal: scheme and host case, www., Telegram host aliases,
+    default ports, trailing slashes, fragments and query order. The scheme
+    is kept (http and https links are different targets), except for
+    Telegram links, which are always https.
+    """
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if host in TELEGRAM_HOSTS:
+        host = 't.me'
+    scheme = 'https' if host == 't.me' else parts.scheme.lower()
+    if parts.port and parts.port != {'http': 80, 'https': 443}.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path.rstrip('/')
+    # Public Telegram usernames are case-insensitive; invite hashes are not
+    if host == 't.me' and not path.startswith(('/+', '/joinchat')):
+        path = path.lower()
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def merge_visitor_sketches(stored: Dict[str, bytes], fresh: Dict[int, HyperLogLog],
+                           oldest_bucket: int) -> Tuple[Dict[str, bytes], List[str]]:
+    """
+    Merge fresh per-bucket sketches of one link into its stored ones.
+    Returns the serialized sketches to write (including the lifetime
+    ``all`` sketch) and the bucket keys that fell out of retention.
+    """
+    updated = {}
+    lifetime = HyperLogLog.from_bytes(stored['all']) if 'all' in stored else None
+    for bucket, sketch in fresh.items():
+        key = str(bucket)
+        if key in stored:
+            sketch.merge(HyperLogLog.from_bytes(stored[key]))
+        updated[key] = sketch.to_bytes()
+        if lifetime is None:
+            lifetime = HyperLogLog(sketch.precision)
+        lifetime.merge(sketch)
+    updated['all'] = lifetime.to_bytes()
+    expired = [key for key in stored if key != 'all' and int(key) < oldest_bucket]
+    return updated, expired
+
+
+def _dedup_form(url: str) -> str:
+    """Canonical form, or the stripped URL if it does not parse (e.g. a bad port)"""
+    try:
+        return canonicalize_url(url)
+    except ValueError:
+        return url.strip()
+
+
+def url_key(url: str) -> bytes:
+    """Compact dedup index key for a URL"""
+    return hashlib.blake2b(_dedup_form(url).encode(), digest_size=8).digest()
+
+
+class SketchLog:
+    """
+    Per-link visitor sketches in an append-only JSON Lines file.
+
+    Each record holds all of one link's serialized sketches; an index maps
+    each token to the offset of its latest record, so a flush appends only
+    the links that changed and a lookup reads one line. Superseded records,
+    and those of links that no longer exist, are dropped by ``compact``.
+    Methods do blocking file I/O; call them from a worker thread.
+    """
+
+    def __init__(self, path: str = 'link_visitors.log', legacy_file: Optional[str] = 'link_visitors.json',
+                 compact_min_records: int = 1000):
+        self.path = path
+        self.legacy_file = legacy_file
+        self.compact_min_records = compact_min_records
+        self.index: Dict[str, int] = {}
+        self.dead_records = 0
+        self.compactions = 0
+        self._size = 0
+
+    def load(self):
+        """Build the index, importing the old whole-file JSON sidecar on first start"""
+        if not os.path.exists(self.path):
+            self._import_legacy()
+        offset = 0
+        with open(self.path, 'a+b') as f:
+            f.seek(0)
+            for line in f:
+                try:
+                    token = json.loads(line)['token']
+                except (json.JSONDecodeError, KeyError):
+                    logger.warning(f"Truncating corrupt tail of {self.path} at offset {offset}")
+                    f.truncate(offset)
+                    break
+                if token in self.index:
+                    self.dead_records += 1
+                self.index[token] = offset
+                offset += len(line)
+        self._size = offset
+
+    def _import_legacy(self):
+        visitors = {}
+        if self.legacy_file:
+            try:
+                with open(self.legacy_file, 'r') as f:
+                    visitors = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            for token, sketches in visitors.items():
+                f.write(self._encode(token, sketches))
+        os.replace(tmp_file, self.path)
+        if visitors:
+            logger.info(f"Imported visitor sketches of {len(visitors)} links from {self.legacy_file}")
+
+    @staticmethod
+    def _encode(token: str, sketches: Dict[str, str]) -> bytes:
+        return (json.dumps({'token': token, 'sketches': sketches}, separators=(',', ':')) + '\n').encode()
+
+    def read(self, token: str) -> Dict[str, bytes]:
+        """Serialized sketches of one link, keyed by bucket and 'all'"""
+        offset = self.index.get(token)
+        if offset is None:
+            return {}
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            record = json.loads(f.readline())
+        return {k: base64.b64decode(v) for k, v in record['sketches'].items()}
+
+    def write_many(self, updates: Dict[str, Dict[str, bytes]]):
+        """Append the new full sketch set of each given link"""
+        with open(self.path, 'ab') as f:
+            for token, sketches in updates.items():
+                line = self._encode(token, {k: base64.b64encode(v).decode() for k, v in sketches.items()})
+                f.write(line)
+                if token in self.index:
+                    self.dead_records += 1
+                self.index[token] = self._size
+                self._size += len(line)
+
+    def needs_compaction(self) -> bool:
+        return self.dead_records >= self.compact_min_records and self.dead_records > len(self.index)
+
+    def compact(self, live: Set[str]):
+        """Rewrite the file with the latest record of every live link"""
+        tmp_file = f"{self.path}.tmp"
+        index = {}
+        pos = 0
+        with open(self.path, 'rb') as src, open(tmp_file, 'wb') as dst:
+            for token, offset in self.index.items():
+                if token not in live:
+                    continue
+                src.seek(offset)
+                line = src.readline()
+                dst.write(line)
+                index[token] = pos
+                pos += len(line)
+        os.replace(tmp_file, self.path)
+        self.index = index
+        self._size = pos
+        self.dead_records = 0
+        self.compactions += 1
+
+
+class LinkStore:
+    """
+    Append-only link storage.
+
+    Every write appends one JSON line to ``log_file``; an in-memory index maps
+    each live token to the offset of its latest record, so lookups and writes
+    are O(1). Superseded and deleted records are reclaimed by compaction,
+    which rewrites the log off the event loop. ``links.json`` is only used as
+    an import source on first start and as an export format.
+
+    A min-heap of ``(expires_at, token)`` lets a background sweeper evict
+    due links without scanning the index. Heap entries are never removed
+    eagerly; ones that no longer match the index are skipped when popped.
+
+    A canonical-URL index maps each protected URL to its newest token so
+    repeat requests can reuse it. It is also validated lazily on lookup.
+    Duplicate tokens minted before the index existed are folded by
+    ``dedupe()`` into small alias records pointing at one canonical record.
+    """
+
+    def __init__(self, log_file: str = 'links.log', export_file: str = 'links.json',
+                 compact_ratio: float = 0.5, compact_min_records: int = 1000,
+                 clicks_file: str = 'link_clicks.json', click_retention_buckets: int = 30 * 24,
+                 visitors_file: str = 'link_visitors.log', visitor_retention_buckets: int = 30):
+        self.log_file = log_file
+        self.export_file = export_file
+        self.clicks_file = clicks_file
+        self.click_retention_buckets = click_retention_buckets
+        self.visitors = SketchLog(visitors_file)
+        self.visitor_retention_buckets = visitor_retention_buckets
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+
+        # token -> (offset of latest record, expires_at)
+        self.index: Dict[str, Tuple[int, int]] = {}
+        self.dead_records = 0
+        self.compactions = 0
+
+        # Expiry index and sweeper stats
+        self.expiry_heap: List[Tuple[int, str]] = []
+        self.expired_reclaimed = 0
+        self.sweeps = 0
+        self.last_sweep_reclaimed = 0
+        self.last_sweep_ms = 0.0
+
+        # url_key(link) -> newest token for that URL
+        self.url_index: Dict[bytes, str] = {}
+        self._duplicate_keys: Set[bytes] = set()
+        self.reused_tokens = 0
+        self.deduplicated = 0
+
+        # Click counts: time bucket -> token -> clicks
+        self.clicks: Dict[int, Dict[str, int]] = self._load_clicks()
+        self._clicks_lock = asyncio.Lock()
+        self._visitors_lock = asyncio.Lock()
+
+        self._compact_tail: Optional[List[bytes]] = None
+        self._load()
+        self.visitors.load()
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        """Build the token index from the log, importing links.json on first start"""
+        if not os.path.exists(self.log_file):
+            self._import_json()
+
+        offset = 0
+        good_offset = 0
+        with open(self.log_file, 'a+b') as f:
+            f.seek(0)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write from a crash can only be the last line
+                    logger.warning(f"Truncating corrupt tail of {self.log_file} at offset {good_offset}")
+                    f.truncate(good_offset)
+                    break
+                self._apply(record, offset)
+                offset += len(line)
+                good_offset = offset
+
+        self._write_pos = good_offset
+        self._writer = open(self.log_file, 'ab')
+        self._reader = open(self.log_file, 'rb')
+        self._rebuild_expiry_heap()
+        logger.info(f"Loaded {len(self.index)} links from {self.log_file}")
+
+    def _import_json(self):
+        """Convert a legacy links.json file into the append-only log"""
+        links = {}
+        try:
+            with open(self.export_file, 'r') as f:
+                links = json.load(f).get('links', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        tmp_file = f"{self.log_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            for token, data in links.items():
+                f.write(self._encode(token, data))
+        os.replace(tmp_file, self.log_file)
+        if links:
+            logger.info(f"Imported {len(links)} links from {self.export_file}")
+
+    def _apply(self, record: Dict, offset: int):
+        """Apply one log record to the in-memory index"""
+        token = record['token']
+        if record.get('deleted'):
+            # The tombstone is dead, and so is the record it removes
+            self.dead_records += 2 if self.index.pop(token, None) is not None else 1
+            return
+        if token in self.index:
+            self.dead_records += 1
+        self.index[token] = (offset, int(record.get('expires_at', 0)))
+        if 'link' in record:
+            key = url_key(record['link'])
+            previous = self.url_index.get(key)
+            if previous is not None and previous != token and previous in self.index:
+                self._duplicate_keys.add(key)
+            self.url_index[key] = token
+
+    @staticmethod
+    def _encode(token: str, data: Dict) -> bytes:
+        record = {'token': token}
+        if 'ref' in data:
+            record['ref'] = data['ref']
+        else:
+            record['link'] = data['link']
+        record['created_at'] = int(data['created_at'])
+        record['expires_at'] = int(data['expires_at'])
+        return json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+    @staticmethod
+    def _encode_delete(token: str) -> bytes:
+        return json.dumps({'token': token, 'deleted': True}, separators=(',', ':')).encode() + b'\n'
+
+    # ------------------------------------------------------------------
+    # Reads and writes
+    # ------------------------------------------------------------------
+
+    def _append(self, lines: List[bytes]) -> List[int]:
+        """Append records with a single write and return their offsets"""
+        offsets = []
+        pos = self._write_pos
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line)
+        self._writer.write(b''.join(lines))
+        self._writer.flush()
+        self._write_pos = pos
+        if self._compact_tail is not None:
+            self._compact_tail.extend(lines)
+        return offsets
+
+    def _read(self, offset: int) -> Dict:
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())
+
+    def _resolve(self, record: Dict) -> Optional[Dict]:
+        """Follow an alias record to the record holding the link"""
+        if 'ref' not in record:
+            return record
+        target = self.index.get(record['ref'])
+        return self._read(target[0]) if target else None
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.index
+
+    async def count(self) -> int:
+        return len(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    async def get(self, token: str) -> Optional[Dict]:
+        """Return the stored record for a token, or None"""
+        entry = self.index.get(token)
+        if entry is None:
+            return None
+        record = self._read(entry[0])
+        target = self._resolve(record)
+        if target is None:
+            return None
+        return {
+            'link': target['link'],
+            'created_at': record['created_at'],
+            'expires_at': record['expires_at']
+        }
+
+    async def find_token(self, url: str, min_expires_at: int = 0) -> Optional[Tuple[str, int]]:
+        """
+        Return (token, expires_at) of a live token already protecting ``url``
+        that expires after ``min_expires_at``
+        """
+        return self._find_token(url, max(min_expires_at, int(time.time())))
+
+    async def find_tokens(self, urls: Iterable[str], min_expires_at: int = 0) -> Dict[str, Tuple[str, int]]:
+        """Bulk ``find_token``: maps each URL that has a reusable token to (token, expires_at)"""
+        min_expires_at = max(min_expires_at, int(time.time()))
+        found = {}
+        for url in urls:
+            match = self._find_token(url, min_expires_at)
+            if match is not None:
+                found[url] = match
+        return found
+
+    def _find_token(self, url: str, min_expires_at: int) -> Optional[Tuple[str, int]]:
+        key = url_key(url)
+        token = self.url_index.get(key)
+        if token is None:
+            return None
+        entry = self.index.get(token)
+        if entry is None or entry[1] <= min_expires_at:
+            # Deleted or expiring soon; let the caller mint a new token
+            if entry is None:
+                del self.url_index[key]
+            return None
+        # Guard against hash collisions
+        if _dedup_form(self._read(entry[0])['link']) != _dedup_form(url):
+            return None
+        self.reused_tokens += 1
+        return token, entry[1]
+
+    async def put(self, token: str, link: str, created_at: int, expires_at: int):
+        """Store a single link"""
+        await self.put_many([(token, {'link': link, 'created_at': created_at, 'expires_at': expires_at})])
+
+    async def put_many(self, records: Iterable[Tuple[str, Dict]]):
+        """Store several links with one log write"""
+        records = list(records)
+        if not records:
+            return
+        offsets = self._append([self._encode(token, data) for token, data in records])
+        for (token, data), offset in zip(records, offsets):
+            if token in self.index:
+                self.dead_records += 1
+            expires_at = int(data['expires_at'])
+            self.index[token] = (offset, expires_at)
+            heapq.heappush(self.expiry_heap, (expires_at, token))
+            if 'link' in data:
+                self.url_index[url_key(data['link'])] = token
+
+    async def delete(self, token: str):
+        """Delete a single link"""
+        await self.delete_many([token])
+
+    async def delete_many(self, tokens: Iterable[str]):
+        """Delete several links with one log write"""
+        tokens = [t for t in tokens if t in self.index]
+        if not tokens:
+            return
+        self._append([self._encode_delete(t) for t in tokens])
+        for token in tokens:
+            del self.index[token]
+            # Both the old record and the tombstone are now dead
+            self.dead_records += 2
+
+    # ------------------------------------------------------------------
+    # Expiry
+    # ------------------------------------------------------------------
+
+    def _rebuild_expiry_heap(self):
+        self.expiry_heap = [(expires_at, token) for token, (_, expires_at) in self.index.items()]
+        heapq.heapify(self.expiry_heap)
+
+    def pop_expired(self, now: Optional[int] = None, limit: int = 5000) -> List[str]:
+        """Pop up to ``limit`` live tokens whose expiry has passed"""
+        now = int(time.time()) if now is None else now
+        heap = self.expiry_heap
+        due = []
+        while heap and heap[0][0] < now and len(due) < limit:
+            expires_at, token = heapq.heappop(heap)
+            entry = self.index.get(token)
+            # Skip entries for links that were deleted or re-saved since
+            if entry is not None and entry[1] == expires_at:
+                due.append(token)
+        return due
+
+    async def sweep_expired(self, batch_size: int = 5000) -> List[str]:
+        """Evict one batch of expired links with a single log write"""
+        started = time.perf_counter()
+        tokens = self.pop_expired(limit=batch_size)
+        await self.delete_many(tokens)
+        self.sweeps += 1
+        self.last_sweep_reclaimed = len(tokens)
+        self.expired_reclaimed += len(tokens)
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        if tokens:
+            logger.info(f"Expiry sweep reclaimed {len(tokens)} links in {self.last_sweep_ms:.1f}ms")
+        return tokens
+
+    async def run_expiry_sweeper(self, interval: int = 60, batch_size: int = 5000,
+                                 on_evict: Optional[Callable[[List[str]], None]] = None):
+        """Periodically evict expired links, sweeping back-to-back while behind"""
+        while True:
+            try:
+                tokens = await self.sweep_expired(batch_size)
+                if on_evict and tokens:
+                    on_evict(tokens)
+                if len(tokens) >= batch_size:
+                    # More links are due; yield to handlers, then keep going
+                    await asyncio.sleep(0)
+                    continue
+            except Exception as e:
+                logger.error(f"Error sweeping expired links: {e}")
+            await asyncio.sleep(interval)
+
+    # ------------------------------------------------------------------
+    # Click counters
+    # ------------------------------------------------------------------
+
+    def _load_clicks(self) -> Dict[int, Dict[str, int]]:
+        try:
+            with open(self.clicks_file, 'r') as f:
+                return {int(bucket): counts for bucket, counts in json.load(f).items()}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_clicks(self):
+        tmp_file = f"{self.clicks_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.clicks, f, separators=(',', ':'))
+        os.replace(tmp_file, self.clicks_file)
+
+    async def add_clicks(self, buckets: Dict[int, Dict[str, int]]):
+        """Merge a batch of bucketed click counts and persist them in one write"""
+        async with self._clicks_lock:
+            for bucket, counts in buckets.items():
+                target = self.clicks.setdefault(bucket, {})
+                for token, clicks in counts.items():
+                    target[token] = target.get(token, 0) + clicks
+            # Drop buckets past the retention window
+            oldest = max(self.clicks) - self.click_retention_buckets
+            for bucket in [b for b in self.clicks if b < oldest]:
+                del self.clicks[bucket]
+            await asyncio.to_thread(self._write_clicks)
+
+    async def top_clicks(self, since_bucket: int, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return the most clicked tokens since a time bucket"""
+        totals: Dict[str, int] = {}
+        for bucket, counts in self.clicks.items():
+            if bucket >= since_bucket:
+                for token, clicks in counts.items():
+                    totals[token] = totals.get(token, 0) + clicks
+        return heapq.nlargest(limit, totals.items(), key=lambda item: item[1])
+
+    async def token_clicks(self, token: str, since_bucket: int) -> int:
+        """Total clicks on one token since a time bucket"""
+        return sum(counts.get(token, 0) for bucket, counts in self.clicks.items() if bucket >= since_bucket)
+
+    # ------------------------------------------------------------------
+    # Unique visitor sketches
+    # ------------------------------------------------------------------
+
+    def _merge_visitors(self, buckets: Dict[int, Dict[str, HyperLogLog]], live: Set[str]):
+        """Merge fresh sketches into the changed links' records (runs in a worker thread)"""
+        oldest = max(buckets) - self.visitor_retention_buckets
+        by_token: Dict[str, Dict[int, HyperLogLog]] = {}
+        for bucket, sketches in buckets.items():
+            for token, sketch in sketches.items():
+                by_token.setdefault(token, {})[bucket] = sketch
+
+        updates = {}
+        for token, fresh in by_token.items():
+            if token not in live:
+                continue
+            stored = self.visitors.read(token)
+            updated, expired = merge_visitor_sketches(stored, fresh, oldest)
+            for key in expired:
+                stored.pop(key, None)
+            stored.update(updated)
+            updates[token] = stored
+        self.visitors.write_many(updates)
+
+        # Superseded records and links that no longer exist
+        if self.visitors.needs_compaction():
+            self.visitors.compact(live)
+
+    async def merge_sketches(self, buckets: Dict[int, Dict[str, HyperLogLog]]):
+        """Merge a batch of per-bucket visitor sketches, appending only the links that changed"""
+        async with self._visitors_lock:
+            await asyncio.to_thread(self._merge_visitors, buckets, set(self.index))
+
+    async def get_sketches(self, token: str) -> Dict[str, HyperLogLog]:
+        """Stored visitor sketches of a link, keyed by bucket and 'all'"""
+        async with self._visitors_lock:
+            stored = await asyncio.to_thread(self.visitors.read, token)
+        return {k: HyperLogLog.from_bytes(v) for k, v in stored.items()}
+
+    # ------------------------------------------------------------------
+    # Deduplication
+    # ------------------------------------------------------------------
+
+    async def dedupe(self) -> int:
+        """
+        Fold duplicate tokens for the same URL into alias records.
+
+        Every token stays valid (it may already be shared), but only the one
+        with the latest expiry keeps the URL; the others are rewritten to
+        reference it and the log is compacted. Only runs when duplicates were
+        seen while loading, so after the first pass it is a no-op.
+        """
+        if not self._duplicate_keys:
+            return 0
+        started = time.monotonic()
+
+        groups: Dict[bytes, List[Tuple[str, Dict]]] = {}
+        for token, (offset, _) in list(self.index.items()):
+            record = self._read(offset)
+            if 'link' not in record:
+                continue
+            key = url_key(record['link'])
+            if key in self._duplicate_keys:
+                groups.setdefault(key, []).append((token, record))
+
+        aliases = []
+        for key, members in groups.items():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda m: m[1]['expires_at'], reverse=True)
+            canonical = members[0][0]
+            self.url_index[key] = canonical
+            for token, record in members[1:]:
+                aliases.append((token, {
+                    'ref': canonical,
+                    'created_at': record['created_at'],
+                    'expires_at': record['expires_at']
+                }))
+
+        self._duplicate_keys.clear()
+        if aliases:
+            await self.put_many(aliases)
+            await self.compact()
+            self.deduplicated += len(aliases)
+        logger.info(f"Deduplicated {len(aliases)} links across {len(groups)} URLs "
+                    f"in {time.monotonic() - started:.2f}s")
+        return len(aliases)
+
+    # ------------------------------------------------------------------
+    # Compaction and export
+    # ------------------------------------------------------------------
+
+    def needs_compaction(self) -> bool:
+        return (self.dead_records >= self.compact_min_records and
+                self.dead_records > self.compact_ratio * (self.dead_records + len(self.index)))
+
+    def _write_snapshot(self, tmp_file: str, snapshot: List[Tuple[str, Tuple[int, int]]]) -> Tuple[Dict, int]:
+        """Copy live records into a fresh log (runs in a worker thread)"""
+        index = {}
+        pos = 0
+        with open(self.log_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+            for token, (offset, expires_at) in snapshot:
+                src.seek(offset)
+                line = src.readline()
+                dst.write(line)
+                index[token] = (pos, expires_at)
+                pos += len(line)
+        return index, pos
+
+    async def compact(self):
+        """Rewrite the log with only live records, without blocking writers"""
+        if self._compact_tail is not None:
+            return
+        started = time.monotonic()
+        tmp_file = f"{self.log_file}.compact"
+        snapshot = list(self.index.items())
+        self._compact_tail = []
+        try:
+            index, pos = await asyncio.to_thread(self._write_snapshot, tmp_file, snapshot)
+        except Exception:
+            self._compact_tail = None
+            raise
+
+        # Replay writes that happened while the snapshot was being written
+        tail = self._compact_tail
+        self._compact_tail = None
+        with open(tmp_file, 'ab') as f:
+            for line in tail:
+                record = json.loads(line)
+                if record.get('deleted'):
+                    index.pop(record['token'], None)
+                else:
+                    index[record['token']] = (pos, int(record['expires_at']))
+                f.write(line)
+                pos += len(line)
+
+        self._writer.close()
+        self._reader.close()
+        os.replace(tmp_file, self.log_file)
+        self._writer = open(self.log_file, 'ab')
+        self._reader = open(self.log_file, 'rb')
+        self._write_pos = pos
+        self.index = index
+        self._rebuild_expiry_heap()
+        reclaimed = self.dead_records
+        self.dead_records = 0
+        self.compactions += 1
+        logger.info(f"Compacted {self.log_file}: {len(index)} live, {reclaimed} dead records "
+                    f"reclaimed in {time.monotonic() - started:.2f}s")
+
+    def _write_export(self, snapshot: List[Tuple[str, Tuple[int, int]]]):
+        links = {}
+        offsets = dict(snapshot)
+        with open(self.log_file, 'rb') as src:
+            for token, (offset, _) in snapshot:
+                src.seek(offset)
+                record = json.loads(src.readline())
+                target = record
+                if 'ref' in record:
+                    if record['ref'] not in offsets:
+                        continue
+                    src.seek(offsets[record['ref']][0])
+                    target = json.loads(src.readline())
+                links[token] = {
+                    'link': target['link'],
+                    'created_at': record['created_at'],
+                    'expires_at': record['expires_at']
+                }
+        tmp_file = f"{self.export_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'links': links}, f, indent=4)
+        os.replace(tmp_file, self.export_file)
+
+    async def export_json(self):
+        """Write all live links to the JSON export file"""
+        await asyncio.to_thread(self._write_export, list(self.index.items()))
+
+    async def run_compaction(self, interval: int = 300):
+        """Periodically compact the log when enough records are dead"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.needs_compaction():
+                    await self.compact()
+                    await self.export_json()
+            except Exception as e:
+                logger.error(f"Error compacting link store: {e}")
+
+    def get_stats(self) -> Dict:
+        """Get link store statistics"""
+        return {
+            'live_links': len(self.index),
+            'dead_records': self.dead_records,
+            'log_bytes': self._write_pos,
+            'compactions': self.compactions,
+            'expiry_heap_size': len(self.expiry_heap),
+            'expired_reclaimed': self.expired_reclaimed,
+            'sweeps': self.sweeps,
+            'last_sweep_reclaimed': self.last_sweep_reclaimed,
+            'last_sweep_ms': round(self.last_sweep_ms, 2),
+            'unique_urls': len(self.url_index),
+            'reused_tokens': self.reused_tokens,
+            'deduplicated': self.deduplicated,
+            'visitor_sketches': len(self.visitors.index),
+            'visitor_dead_records': self.visitors.dead_records
+        }
+
+    def close(self):
+        """Close the log file handles"""
+        self._writer.close()
+        self._reader.close()
+
+
+class MongoLinkStore:
+    """
+    Link storage on the shared ``links`` collection.
+
+    Documents carry the same fields as LinkStore records plus ``url_key``
+    (for dedup) and ``expire_on``, a BSON date that a TTL index uses to let
+    the server delete expired links. Token lookups are answered from the
+    ``token_lookup`` compound index alone (covered query), so no document
+    is fetched.
+    """
+
+    LOOKUP_INDEX = 'token_lookup'
+    LOOKUP_PROJECTION = {'_id': 0, 'link': 1, 'ref': 1, 'created_at': 1, 'expires_at': 1}
+
+    def __init__(self, collection, clicks_collection=None, click_retention_buckets: int = 30 * 24,
+                 visitor_retention_buckets: int = 30):
+        self.collection = collection
+        self.clicks_collection = clicks_collection
+        self.click_retention_buckets = click_retention_buckets
+        self.visitor_retention_buckets = visitor_retention_buckets
+        self.lookups = 0
+        self.reused_tokens = 0
+        self.deduplicated = 0
+        self.imported = 0
+
+    async def create_indexes(self):
+        """Create the TTL, covered-lookup and dedup indexes"""
+        await self.collection.create_index('token', unique=True)
+        await self.collection.create_index('expire_on', expireAfterSeconds=0)
+        await self.collection.create_index(
+            [('token', 1), ('link', 1), ('ref', 1), ('created_at', 1), ('expires_at', 1)],
+            name=self.LOOKUP_INDEX
+        )
+        await self.collection.create_index(
+            [('url_key', 1), ('expires_at', -1)],
+            partialFilterExpression={'url_key': {'$exists': True}}
+        )
+        if self.clicks_collection is not None:
+            await self.clicks_collection.create_index([('token', 1), ('bucket', 1)], unique=True)
+            await self.clicks_collection.create_index('bucket')
+
+    @staticmethod
+    def _to_document(token: str, data: Dict) -> Dict:
+        expires_at = int(data['expires_at'])
+        doc = {
+            'token': token,
+            'created_at': int(data['created_at']),
+            'expires_at': expires_at,
+            'expire_on': datetime.fromtimestamp(expires_at, timezone.utc)
+        }
+        if 'ref' in data:
+            doc['ref'] = data['ref']
+        else:
+            doc['link'] = data['link']
+            doc['url_key'] = url_key(data['link'])
+        return doc
+
+    async def _lookup(self, token: str) -> Optional[Dict]:
+        self.lookups += 1
+        return await self.collection.find_one(
+            {'token': token}, self.LOOKUP_PROJECTION, hint=self.LOOKUP_INDEX
+        )
+
+    async def get(self, token: str) -> Optional[Dict]:
+        """Return the stored record for a token, or None"""
+        record = await self._lookup(token)
+        if record is None:
+            return None
+        target = record
+        if record.get('ref'):
+            target = await self._lookup(record['ref'])
+            if target is None:
+                return None
+        return {
+            'link': target['link'],
+            'created_at': record['created_at'],
+            'expires_at': record['expires_at']
+        }
+
+    async def find_token(self, url: str, min_expires_at: int = 0) -> Optional[Tuple[str, int]]:
+        """
+        Return (token, expires_at) of a live token already protecting ``url``
+        that expires after ``min_expires_at``
+        """
+        doc = await self.collection.find_one(
+            {'url_key': url_key(url), 'expires_at': {'$gt': max(min_expires_at, int(time.time()))}},
+            {'_id': 0, 'token': 1, 'link': 1, 'expires_at': 1},
+            sort=[('expires_at', -1)]
+        )
+        # Guard against hash collisions
+        if doc is None or _dedup_form(doc['link']) != _dedup_form(url):
+            return None
+        self.reused_tokens += 1
+        return doc['token'], doc['expires_at']
+
+    async def find_tokens(self, urls: Iterable[str], min_expires_at: int = 0) -> Dict[str, Tuple[str, int]]:
+        """
+        Bulk ``find_token`` in one query on the url_key index: maps each URL
+        that has a reusable token to (token, expires_at) of the latest one
+        """
+        by_key: Dict[bytes, List[str]] = {}
+        for url in urls:
+            by_key.setdefault(url_key(url), []).append(url)
+        if not by_key:
+            return {}
+        found: Dict[str, Tuple[str, int]] = {}
+        cursor = self.collection.find(
+            {'url_key': {'$in': list(by_key)}, 'expires_at': {'$gt': max(min_expires_at, int(time.time()))}},
+            {'_id': 0, 'token': 1, 'link': 1, 'expires_at': 1, 'url_key': 1}
+        )
+        async for doc in cursor:
+            # Guard against hash collisions
+            form = _dedup_form(doc['link'])
+            for url in by_key.get(bytes(doc['url_key']), ()):
+                if _dedup_form(url) == form and (url not in found or doc['expires_at'] > found[url][1]):
+                    found[url] = (doc['token'], doc['expires_at'])
+        self.reused_tokens += len(found)
+        return found
+
+    async def put(self, token: str, link: str, created_at: int, expires_at: int):
+        """Store a single link"""
+        await self.put_many([(token, {'link': link, 'created_at': created_at, 'expires_at': expires_at})])
+
+    async def put_many(self, records: Iterable[Tuple[str, Dict]]):
+        """Store several links in one bulk write"""
+        ops = [ReplaceOne({'token': token}, self._to_document(token, data), upsert=True)
+               for token, data in records]
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+
+    async def delete(self, token: str):
+        """Delete a single link"""
+        await self.collection.delete_one({'token': token})
+
+    async def delete_many(self, tokens: Iterable[str]):
+        """Delete several links in one round trip"""
+        tokens = list(tokens)
+        if tokens:
+            await self.collection.delete_many({'token': {'$in': tokens}})
+
+    async def count(self) -> int:
+        return await self.collection.estimated_document_count()
+
+    async def add_clicks(self, buckets: Dict[int, Dict[str, int]]):
+        """
+        Apply a batch of bucketed click counts as one $inc bulk write, then
+        drop buckets past retention (as the file store does)
+        """
+        ops = [
+            UpdateOne({'token': token, 'bucket': bucket}, {'$inc': {'clicks': clicks}}, upsert=True)
+            for bucket, counts in buckets.items()
+            for token, clicks in counts.items()
+        ]
+        if not ops:
+            return
+        await self.clicks_collection.bulk_write(ops, ordered=False)
+        # Range delete on the bucket index; also covers clicks of deleted links
+        oldest = max(buckets) - self.click_retention_buckets
+        await self.clicks_collection.delete_many({'bucket': {'$lt': oldest}})
+
+    async def top_clicks(self, since_bucket: int, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return the most clicked tokens since a time bucket"""
+        pipeline = [
+            {'$match': {'bucket': {'$gte': since_bucket}}},
+            {'$group': {'_id': '$token', 'clicks': {'$sum': '$clicks'}}},
+            {'$sort': {'clicks': -1}},
+            {'$limit': limit}
+        ]
+        return [(doc['_id'], doc['clicks'])
+                async for doc in self.clicks_collection.aggregate(pipeline, allowDiskUse=True)]
+
+    async def token_clicks(self, token: str, since_bucket: int) -> int:
+        """Total clicks on one token since a time bucket"""
+        pipeline = [
+            {'$match': {'token': token, 'bucket': {'$gte': since_bucket}}},
+            {'$group': {'_id': None, 'clicks': {'$sum': '$clicks'}}}
+        ]
+        async for doc in self.clicks_collection.aggregate(pipeline):
+            return doc['clicks']
+        return 0
+
+    async def merge_sketches(self, buckets: Dict[int, Dict[str, HyperLogLog]], chunk_size: int = 500):
+        """
+        Merge per-bucket visitor sketches into the ``visitors`` field of each
+        link document, so they expire together with the link.
+        """
+        oldest = max(buckets) - self.visitor_retention_buckets
+        by_token: Dict[str, Dict[int, HyperLogLog]] = {}
+        for bucket, sketches in buckets.items():
+            for token, sketch in sketches.items():
+                by_token.setdefault(token, {})[bucket] = sketch
+
+        tokens = list(by_token)
+        for i in range(0, len(tokens), chunk_size):
+            chunk = tokens[i:i + chunk_size]
+            ops = []
+            async for doc in self.collection.find({'token': {'$in': chunk}}, {'_id': 0, 'token': 1, 'visitors': 1}):
+                stored = doc.get('visitors', {})
+                updated, expired = merge_visitor_sketches(stored, by_token[doc['token']], oldest)
+                update = {'$set': {f'visitors.{k}': v for k, v in updated.items()}}
+                if expired:
+                    update['$unset'] = {f'visitors.{k}': '' for k in expired}
+                ops.append(UpdateOne({'token': doc['token']}, update))
+            if ops:
+                await self.collection.bulk_write(ops, ordered=False)
+
+    async def get_sketches(self, token: str) -> Dict[str, HyperLogLog]:
+        """Stored visitor sketches of a link, keyed by bucket and 'all'"""
+        doc = await self.collection.find_one({'token': token}, {'_id': 0, 'visitors': 1})
+        visitors = (doc or {}).get('visitors', {})
+        return {k: HyperLogLog.from_bytes(v) for k, v in visitors.items()}
+
+    async def dedupe(self) -> int:
+        """Fold duplicate tokens for the same URL into alias documents (see LinkStore.dedupe)"""
+        pipeline = [
+            {'$match': {'url_key': {'$exists': True}}},
+            {'$group': {
+                '_id': '$url_key',
+                'tokens': {'$push': {
+                    'token': '$token', 'created_at': '$created_at', 'expires_at': '$expires_at'
+                }},
+                'count': {'$sum': 1}
+            }},
+            {'$match': {'count': {'$gt': 1}}}
+        ]
+        ops = []
+        folded = 0
+        async for group in self.collection.aggregate(pipeline, allowDiskUse=True):
+            members = sorted(group['tokens'], key=lambda m: m['expires_at'], reverse=True)
+            canonical = members[0]['token']
+            for member in members[1:]:
+                alias = self._to_document(member['token'], {
+                    'ref': canonical,
+                    'created_at': member['created_at'],
+                    'expires_at': member['expires_at']
+                })
+                ops.append(ReplaceOne({'token': member['token']}, alias))
+                folded += 1
+            if len(ops) >= 1000:
+                await self.collection.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+        self.deduplicated += folded
+        logger.info(f"Deduplicated {folded} links in {self.collection.name}")
+        return folded
+
+    async def import_records(self, records: Iterable[Dict], chunk_size: int = 1000) -> AsyncIterator[int]:
+        """
+        Bulk-load log-format records in chunks, yielding the running total
+        after each chunk. Upserts make the import safe to re-run.
+        """
+        ops = []
+        total = 0
+        for record in records:
+            token = record['token']
+            if record.get('deleted'):
+                ops.append(DeleteOne({'token': token}))
+            else:
+                ops.append(ReplaceOne({'token': token}, self._to_document(token, record), upsert=True))
+            if len(ops) >= chunk_size:
+                # Ordered, so a tombstone always follows the record it removes
+                await self.collection.bulk_write(ops, ordered=True)
+                total += len(ops)
+                ops = []
+                yield total
+        if ops:
+            await self.collection.bulk_write(ops, ordered=True)
+            total += len(ops)
+            yield total
+        self.imported += total
+
+    def get_stats(self) -> Dict:
+        """Get link store statistics"""
+        return {
+            'backend': 'mongo',
+            'lookups': self.lookups,
+            'reused_tokens': self.reused_tokens,
+            'deduplicated': self.deduplicated,
+            'imported': self.imported
+        }
+
+    def close(self):
+        """Nothing to close; the Mongo client is owned by the bot"""
+
+
+def iter_log_records(path: str) -> Iterator[Dict]:
+    """Stream records from a LinkStore log, one line at a time"""
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Torn tail from a crash
+                break
+
+
+def iter_json_links(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    """
+    Stream entries of a ``{"links": {token: {...}}}`` export without loading
+    the whole file, yielding log-format records.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        eof = False
+
+        def fill() -> bool:
+            nonlocal buf, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buf += chunk
+            return True
+
+        # Find the opening brace of the "links" object
+        while True:
+            start = buf.find('"links"')
+            brace = buf.find('{', start) if start != -1 else -1
+            if brace != -1:
+                buf = buf[brace + 1:]
+                break
+            if not fill():
+                return
+
+        while True:
+            buf = buf.lstrip(' \t\r\n,')
+            if not buf:
+                if not fill():
+                    return
+                continue
+            if buf[0] == '}':
+                return
+            try:
+                token, pos = decoder.raw_decode(buf)
+                pos = buf.index(':', pos) + 1
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                data, end = decoder.raw_decode(buf, pos)
+            except (json.JSONDecodeError, ValueError):
+                # Entry spans the chunk boundary
+                if eof or not fill():
+                    raise
+                continue
+            buf = buf[end:]
+            yield {'token': token, **data}
@@ -0,0 +1,179 @@
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('LogStore')
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_SEGMENT_RE = re.compile(r'^segment-(\d{6})-(\d{14})\.jsonl(\.gz)?$')
+
+
+class SegmentedLog:
+    """
+    Append-only JSON Lines log split into segments.
+
+    New entries go to one active segment, which is closed and
+    gzip-compressed once it reaches ``max_bytes`` or is ``max_age`` seconds
+    old. Closed segments older than ``retention_days`` are deleted. Each
+    segment is named after its sequence number and the timestamp of its
+    first entry, so ``read`` can skip whole segments outside a time range
+    and stream the rest line by line.
+
+    Appends are blocking file I/O; call them from a worker thread.
+    """
+
+    def __init__(self, directory: str = 'logs', max_bytes: int = 4 * 1024 * 1024,
+                 max_age: float = 86400, retention_days: float = 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retention_days = retention_days
+        self._active = None
+        self._active_path: Optional[str] = None
+        self._active_opened = 0.0
+        self._active_size = 0
+        self._seq = 0
+        self.appended = 0
+        self.rotations = 0
+        self.expired = 0
+
+    def _segments(self) -> List[Tuple[int, str, str]]:
+        """(sequence, start timestamp, path) of every segment, oldest first"""
+        segments: Dict[int, Tuple[str, str]] = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            match = _SEGMENT_RE.match(name)
+            if not match:
+                continue
+            seq = int(match.group(1))
+            # A compressed copy wins over a plain file left by an interrupted rotation
+            if seq in segments and not match.group(3):
+                continue
+            segments[seq] = (match.group(2), os.path.join(self.directory, name))
+        return [(seq, start, path) for seq, (start, path) in sorted(segments.items())]
+
+    def open(self):
+        """Create the directory and close out segments left by a previous run"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        self._seq = segments[-1][0] if segments else 0
+        for _, _, path in segments:
+            if not path.endswith('.gz'):
+                self._compress(path)
+        self._expire()
+
+    def is_empty(self) -> bool:
+        return self._active is None and not self._segments()
+
+    def append_many(self, entries: Iterable[Dict]):
+        """Append entries (each with a ``timestamp``) in order"""
+        lines = [json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries]
+        if not lines:
+            return
+        if self._active is not None and (self._active_size >= self.max_bytes or
+                                         time.time() - self._active_opened >= self.max_age):
+            self.rotate()
+        if self._active is None:
+            self._open_segment(json.loads(lines[0]).get('timestamp'))
+        data = ''.join(lines).encode('utf-8')
+        self._active.write(data)
+        self._active.flush()
+        self._active_size += len(data)
+        self.appended += len(lines)
+
+    def _open_segment(self, first_timestamp: Optional[str]):
+        try:
+            started = datetime.strptime(first_timestamp, TIMESTAMP_FORMAT)
+        except (TypeError, ValueError):
+            started = datetime.now()
+        self._seq += 1
+        name = f"segment-{self._seq:06d}-{started.strftime('%Y%m%d%H%M%S')}.jsonl"
+        self._active_path = os.path.join(self.directory, name)
+        self._active = open(self._active_path, 'ab')
+        self._active_opened = time.time()
+        self._active_size = 0
+
+    def rotate(self):
+        """Close and compress the active segment, then apply retention"""
+        if self._active is None:
+            return
+        self._active.close()
+        self._active = None
+        self._compress(self._active_path)
+        self.rotations += 1
+        self._expire()
+
+    def _compress(self, path: str):
+        tmp_path = f"{path}.gz.tmp"
+        with open(path, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, f"{path}.gz")
+        os.remove(path)
+
+    def _expire(self):
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for _, _, path in self._segments():
+            # Only closed segments; the mtime is the time of their last entry
+            if path.endswith('.gz') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                self.expired += 1
+
+    def close(self):
+        """Close the active segment without compressing it (done on next open)"""
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+    def read(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Iterator[Dict]:
+        """
+        Stream entries with ``since <= timestamp < until``, oldest first.
+        Only segments that can overlap the range are opened.
+        """
+        low = since.strftime(TIMESTAMP_FORMAT) if since else None
+        high = until.strftime(TIMESTAMP_FORMAT) if until else None
+        segments = self._segments()
+        for i, (_, start, path) in enumerate(segments):
+            start = datetime.strptime(start, '%Y%m%d%H%M%S').strftime(TIMESTAMP_FORMAT)
+            if high is not None and start >= high:
+                break
+            # Every entry of this segment precedes the next segment's first entry
+            if low is not None and i + 1 < len(segments):
+                next_start = datetime.strptime(segments[i + 1][1], '%Y%m%d%H%M%S').strftime(TIMESTAMP_FORMAT)
+                if next_start < low:
+                    continue
+            try:
+                f = gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else \
+                    open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue  # expired or compressed while we were listing
+            with f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line still being written
+                    timestamp = entry.get('timestamp', '')
+                    if (low is None or timestamp >= low) and (high is None or timestamp < high):
+                        yield entry
+
+    def get_stats(self) -> Dict:
+        segments = self._segments()
+        return {
+            'segments': len(segments),
+            'disk_bytes': sum(os.path.getsize(path) for _, _, path in segments if os.path.exists(path)),
+            'active_bytes': self._active_size if self._active is not None else 0,
+            'appended': self.appended,
+            'rotations': self.rotations,
+            'expired': self.expired
+        }
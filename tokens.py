@@ -0,0 +1,263 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from cache import TTLCache
+
+logger = logging.getLogger('Tokens')
+
+# Signed link tokens: "v3-" + base64url(created_at | expires_at | nonce | mac)
+LINK_TOKEN_PREFIX = 'v3-'
+# Unsigned tokens: "v2-" + base64url("created_at-expires_at-random")
+LEGACY_LINK_TOKEN_PREFIX = 'v2-'
+
+_LINK_PAYLOAD = struct.Struct('>II6s')
+_LINK_MAC_SIZE = 10
+_LINK_TOKEN_LENGTH = len(LINK_TOKEN_PREFIX) + 4 * (_LINK_PAYLOAD.size + _LINK_MAC_SIZE) // 3
+_LEGACY_PAYLOAD_RE = re.compile(r'^(\d{1,12})-(\d{1,12})-[A-Za-z0-9]{8}$')
+
+# Stateless verification tokens: "vt-" + base64url(user_id | expires | nonce | mac)
+VERIFY_TOKEN_PREFIX = 'vt-'
+_VERIFY_PAYLOAD = struct.Struct('>qI6s')
+_VERIFY_MAC_SIZE = 12
+_VERIFY_TOKEN_LENGTH = len(VERIFY_TOKEN_PREFIX) + 4 * (_VERIFY_PAYLOAD.size + _VERIFY_MAC_SIZE) // 3
+
+
+class TokenSigner:
+    """
+    Issues and checks self-validating link tokens.
+
+    The expiry travels inside the token together with a truncated
+    HMAC-SHA256, so forged, mistyped or expired tokens can be rejected
+    without a storage lookup. Tokens are 35 characters from Telegram's
+    start-parameter alphabet, well under its 64-character limit.
+
+    It also issues stateless verification tokens binding a user id to an
+    expiry (43 characters). A bounded replay cache makes each one single
+    use; if it overflows, the oldest entries are dropped first, which only
+    reopens replay for tokens that are about to expire anyway.
+    """
+
+    def __init__(self, secret: bytes, replay_cache_size: int = 100000):
+        self.secret = secret
+        self.used_verify_tokens = TTLCache(maxsize=replay_cache_size)
+        self.replays_rejected = 0
+
+    def _mac(self, payload: bytes, size: int = _LINK_MAC_SIZE) -> bytes:
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()[:size]
+
+    def generate_link_token(self, expires_at: int, created_at: Optional[int] = None) -> str:
+        """Generate a signed token for a protected link"""
+        created_at = int(time.time()) if created_at is None else created_at
+        payload = _LINK_PAYLOAD.pack(created_at, expires_at, secrets.token_bytes(6))
+        return LINK_TOKEN_PREFIX + base64.urlsafe_b64encode(payload + self._mac(payload)).decode()
+
+    def parse_link_token(self, token: str) -> Optional[Tuple[int, int]]:
+        """
+        Return (created_at, expires_at) carried by a token, or None if it is
+        malformed or its signature does not match. Legacy unsigned tokens are
+        parsed but cannot be authenticated.
+        """
+        if token.startswith(LINK_TOKEN_PREFIX):
+            if len(token) != _LINK_TOKEN_LENGTH:
+                return None
+            try:
+                raw = base64.urlsafe_b64decode(token[len(LINK_TOKEN_PREFIX):])
+            except (binascii.Error, ValueError):
+                return None
+            payload, mac = raw[:_LINK_PAYLOAD.size], raw[_LINK_PAYLOAD.size:]
+            if not hmac.compare_digest(mac, self._mac(payload)):
+                return None
+            created_at, expires_at, _ = _LINK_PAYLOAD.unpack(payload)
+            return created_at, expires_at
+
+        if token.startswith(LEGACY_LINK_TOKEN_PREFIX):
+            try:
+                raw = base64.urlsafe_b64decode(token[len(LEGACY_LINK_TOKEN_PREFIX):]).decode()
+            except (binascii.Error, ValueError):
+                return None
+            match = _LEGACY_PAYLOAD_RE.match(raw)
+            if not match:
+                return None
+            return int(match.group(1)), int(match.group(2))
+
+        return None
+
+    def check_link_token(self, token: str, now: Optional[int] = None) -> bool:
+        """Cheap pre-storage check: well-formed, authentic and not expired"""
+        parsed = self.parse_link_token(token)
+        if parsed is None:
+            return False
+        now = int(time.time()) if now is None else now
+        return now <= parsed[1]
+
+    def generate_verification_token(self, user_id: int, ttl: int = 600) -> str:
+        """Generate a signed, self-expiring verification token for a user"""
+        payload = _VERIFY_PAYLOAD.pack(user_id, int(time.time()) + ttl, secrets.token_bytes(6))
+        mac = self._mac(b'verify:' + payload, _VERIFY_MAC_SIZE)
+        return VERIFY_TOKEN_PREFIX + base64.urlsafe_b64encode(payload + mac).decode()
+
+    def verify_verification_token(self, token: str, user_id: int) -> bool:
+        """Check and consume a stateless verification token"""
+        if len(token) != _VERIFY_TOKEN_LENGTH or not token.startswith(VERIFY_TOKEN_PREFIX):
+            return False
+        try:
+            raw = base64.urlsafe_b64decode(token[len(VERIFY_TOKEN_PREFIX):])
+        except (binascii.Error, ValueError):
+            return False
+        payload, mac = raw[:_VERIFY_PAYLOAD.size], raw[_VERIFY_PAYLOAD.size:]
+        if not hmac.compare_digest(mac, self._mac(b'verify:' + payload, _VERIFY_MAC_SIZE)):
+            return False
+        token_user_id, expires, _ = _VERIFY_PAYLOAD.unpack(payload)
+        if token_user_id != user_id or int(time.time()) > expires:
+            return False
+        if mac in self.used_verify_tokens:
+            self.replays_rejected += 1
+            return False
+        # Remember the token until it would have expired anyway
+        self.used_verify_tokens.set(mac, True, ttl=expires - time.time() + 1)
+        return True
+
+
+def is_verification_token(token: str) -> bool:
+    """Whether a /start parameter is a stateless verification token"""
+    return token.startswith(VERIFY_TOKEN_PREFIX)
+
+
+def is_link_token(token: str) -> bool:
+    """Whether a /start parameter refers to a protected link"""
+    return token.startswith((LINK_TOKEN_PREFIX, LEGACY_LINK_TOKEN_PREFIX))
+
+
+class VerificationTokenStore:
+    """
+    In-memory table of verification tokens.
+
+    Tokens expire after ``ttl`` seconds and are reclaimed by an
+    expiry-ordered sweep rather than only when presented. A per-user index
+    hands out the user's live token again on repeated /start calls. The
+    table can be snapshotted to ``snapshot_file`` (same format as the old
+    verification_tokens.json) so pending verifications survive restarts.
+    """
+
+    def __init__(self, ttl: int = 600, snapshot_file: Optional[str] = 'verification_tokens.json',
+                 reuse_min_remaining: int = 120):
+        self.ttl = ttl
+        self.snapshot_file = snapshot_file
+        self.reuse_min_remaining = reuse_min_remaining
+        self.tokens: Dict[str, Tuple[int, int]] = {}  # token -> (user_id, expires)
+        self.by_user: Dict[int, str] = {}
+        self.expiry_heap: List[Tuple[int, str]] = []
+        self.issued = 0
+        self.reused = 0
+        self.swept = 0
+        self._dirty = False
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        if not self.snapshot_file:
+            return
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        now = int(time.time())
+        for token, entry in data.items():
+            if entry.get('expires', 0) >= now:
+                self._add(token, int(entry['user_id']), int(entry['expires']))
+
+    def _add(self, token: str, user_id: int, expires: int):
+        self.tokens[token] = (user_id, expires)
+        self.by_user[user_id] = token
+        heapq.heappush(self.expiry_heap, (expires, token))
+
+    def _remove(self, token: str):
+        user_id, _ = self.tokens.pop(token)
+        if self.by_user.get(user_id) == token:
+            del self.by_user[user_id]
+        self._dirty = True
+
+    def issue(self, user_id: int) -> str:
+        """Return the user's live token, or mint a new one"""
+        now = int(time.time())
+        token = self.by_user.get(user_id)
+        if token is not None:
+            if self.tokens[token][1] - now >= self.reuse_min_remaining:
+                self.reused += 1
+                return token
+            self._remove(token)
+
+        token_data = f"{user_id}:{now}:{secrets.token_bytes(16).hex()}"
+        token = hashlib.sha256(token_data.encode()).hexdigest()[:32]
+        self._add(token, user_id, now + self.ttl)
+        self.issued += 1
+        self._dirty = True
+        return token
+
+    def verify(self, token: str, user_id: int) -> bool:
+        """Consume a token; valid only for its user and before expiry"""
+        entry = self.tokens.get(token)
+        if entry is None:
+            return False
+        self._remove(token)
+        return entry[0] == user_id and int(time.time()) <= entry[1]
+
+    def sweep(self, now: Optional[int] = None) -> int:
+        """Drop every expired token; returns how many were removed"""
+        now = int(time.time()) if now is None else now
+        heap = self.expiry_heap
+        removed = 0
+        while heap and heap[0][0] < now:
+            expires, token = heapq.heappop(heap)
+            entry = self.tokens.get(token)
+            if entry is not None and entry[1] == expires:
+                self._remove(token)
+                removed += 1
+        self.swept += removed
+        return removed
+
+    def _write_snapshot(self, data: Dict):
+        tmp_file = f"{self.snapshot_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.snapshot_file)
+
+    async def snapshot(self):
+        """Persist live tokens if anything changed since the last snapshot"""
+        if not self.snapshot_file or not self._dirty:
+            return
+        self._dirty = False
+        data = {token: {'user_id': user_id, 'expires': expires}
+                for token, (user_id, expires) in self.tokens.items()}
+        await asyncio.to_thread(self._write_snapshot, data)
+
+    async def run_sweeper(self, interval: int = 60):
+        """Periodically sweep expired tokens and snapshot the table"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+                await self.snapshot()
+            except Exception as e:
+                logger.error(f"Error sweeping verification tokens: {e}")
+
+    def get_stats(self) -> Dict:
+        """Get verification token statistics"""
+        return {
+            'live_tokens': len(self.tokens),
+            'issued': self.issued,
+            'reused': self.reused,
+            'swept': self.swept
+        }
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from array import array
+from typing import Dict, Iterator, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+from idset import IdSet
+
+logger = logging.getLogger('UserStore')
+
+
+def _read_legacy_ids(path: Optional[str], key: Optional[str]) -> list:
+    """User ids from an old ``{key: [ids]}`` JSON file, if there is one"""
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            return [int(user_id) for user_id in json.load(f).get(key, [])]
+    except json.JSONDecodeError:
+        return []
+
+
+class FileUserSet:
+    """
+    Set of user ids persisted as a binary IdSet file.
+
+    Loading maps the file instead of parsing it. Changes mark the set dirty
+    and are written by ``flush`` (periodically and on shutdown) rather than
+    on every change. A missing file is seeded from the legacy JSON list.
+    """
+
+    def __init__(self, path: str, legacy_file: Optional[str] = None, legacy_key: Optional[str] = None):
+        self.path = path
+        self.legacy_file = legacy_file
+        self.legacy_key = legacy_key
+        self.members = IdSet()
+        self._dirty = False
+        self.writes = 0
+
+    async def load(self):
+        try:
+            self.members = IdSet.load(self.path)
+        except (FileNotFoundError, ValueError):
+            self.members = IdSet.from_iterable(_read_legacy_ids(self.legacy_file, self.legacy_key))
+            self._dirty = len(self.members) > 0
+
+    def add(self, user_id: int) -> bool:
+        if user_id in self.members:
+            return False
+        self.members.add(user_id)
+        self._dirty = True
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        if user_id not in self.members:
+            return False
+        self.members.discard(user_id)
+        self._dirty = True
+        return True
+
+    def _write(self, data: bytes):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        """Write the set if it changed since the last flush"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Serialize on the loop, write in a thread
+        await asyncio.to_thread(self._write, self.members.to_bytes())
+        self.writes += 1
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.members)
+
+    def snapshot(self) -> IdSet:
+        return self.members.snapshot()
+
+    def get_stats(self) -> Dict:
+        return {'backend': 'file', 'writes': self.writes, **self.members.get_stats()}
+
+
+class MongoUserSet:
+    """
+    Set of user ids backed by a Mongo collection (one ``{user_id}`` document
+    per member, unique index on ``user_id``).
+
+    Membership checks only touch memory. Changes are buffered, with the last
+    change per user winning, and written in one unordered ``bulk_write`` once
+    ``flush_size`` are pending, on the periodic flusher and on shutdown.
+
+    With a ``cache_path`` the set is also kept as a local binary IdSet file,
+    saved after each flush. On boot that file is mapped so the set is usable
+    at once, and the collection (which other instances may have changed) is
+    read in the background to replace it.
+    """
+
+    def __init__(self, collection, flush_size: int = 500,
+                 legacy_file: Optional[str] = None, legacy_key: Optional[str] = None,
+                 cache_path: Optional[str] = None):
+        self.collection = collection
+        self.flush_size = flush_size
+        self.legacy_file = legacy_file
+        self.legacy_key = legacy_key
+        self.cache_path = cache_path
+        self.members = IdSet()
+        self._pending: Dict[int, bool] = {}  # user_id -> True (add) / False (remove)
+        self._changes: Optional[Dict[int, bool]] = None  # changes made while refreshing
+        self._flush_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.loaded_from_cache = False
+        self.flushes = 0
+        self.written = 0
+        self.last_flush_ms = 0.0
+
+    async def load(self):
+        """Read all members; seed an empty collection from the legacy JSON file"""
+        if self.cache_path:
+            try:
+                self.members = IdSet.load(self.cache_path)
+            except (FileNotFoundError, ValueError):
+                pass
+            else:
+                self.loaded_from_cache = True
+                self._refresh_task = asyncio.ensure_future(self._refresh_logged())
+                return
+        await self.refresh()
+        if len(self.members):
+            return
+        legacy = _read_legacy_ids(self.legacy_file, self.legacy_key)
+        if not legacy:
+            return
+        for user_id in legacy:
+            self.add(user_id)
+        await self.flush()
+        logger.info(f"Imported {len(legacy)} users from {self.legacy_file}")
+
+    async def refresh(self):
+        """Replace the members with the collection's, keeping local changes it may not have yet"""
+        self._changes = dict(self._pending)
+        try:
+            # Sorted by the unique user_id index, so the ids go straight into the array
+            ids = array('q')
+            cursor = self.collection.find({}, {'_id': 0, 'user_id': 1}).sort('user_id', 1).batch_size(10000)
+            async for doc in cursor:
+                ids.append(doc['user_id'])
+            members = IdSet(ids)
+            for user_id, present in self._changes.items():
+                if present:
+                    members.add(user_id)
+                else:
+                    members.discard(user_id)
+        finally:
+            self._changes = None
+        self.members = members
+        await self._save_cache()
+
+    async def _refresh_logged(self):
+        try:
+            await self.refresh()
+            logger.info(f"Refreshed {len(self.members)} users from {self.collection.name}")
+        except Exception as e:
+            logger.error(f"Error refreshing {self.collection.name}, keeping the cached set: {e}")
+
+    def _write_cache(self, data: bytes):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_path)
+
+    async def _save_cache(self):
+        if self.cache_path:
+            # Serialize on the loop, write in a thread
+            await asyncio.to_thread(self._write_cache, self.members.to_bytes())
+
+    def _record(self, user_id: int, present: bool):
+        self._pending[user_id] = present
+        if self._changes is not None:
+            self._changes[user_id] = present
+        if len(self._pending) >= self.flush_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self._flush_logged())
+
+    def add(self, user_id: int) -> bool:
+        """Add a member; returns False if it was already present"""
+        if user_id in self.members:
+            return False
+        self.members.add(user_id)
+        self._record(user_id, True)
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        """Remove a member; returns False if it was not present"""
+        if user_id not in self.members:
+            return False
+        self.members.discard(user_id)
+        self._record(user_id, False)
+        return True
+
+    async def flush(self):
+        """Write all buffered changes in one bulk operation"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        started = time.perf_counter()
+        now = time.time()
+        requests = [
+            UpdateOne({'user_id': user_id}, {'$setOnInsert': {'user_id': user_id, 'added_at': now}}, upsert=True)
+            if present else DeleteOne({'user_id': user_id})
+            for user_id, present in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except Exception:
+            # Keep changes made since the swap; retry the rest next time
+            for user_id, present in pending.items():
+                self._pending.setdefault(user_id, present)
+            raise
+        self.flushes += 1
+        self.written += len(requests)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        await self._save_cache()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing {self.collection.name}: {e}")
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.members)
+
+    def snapshot(self) -> IdSet:
+        return self.members.snapshot()
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': 'mongo',
+            **self.members.get_stats(),
+            'boot_cache': self.cache_path if self.loaded_from_cache else None,
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'written': self.written,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }